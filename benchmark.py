@@ -0,0 +1,235 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Measures the scenes of scenes.BENCHMARK_SCENES over a range of sizes (number of points):
+#
+#   python benchmark.py --sizes 10,1000,100000 --scenes cloth,spring_network
+#
+# For each scene and size: substeps per second, physics time per frame, drawing time per frame (updating the
+# artists, then rendering them with Agg) and peak memory (tracemalloc, while building the scene and computing a
+# step). The results are saved in benchmarks/<version>.json, --compare prints the speedups against another file.
+#
+#   python benchmark.py --imports
+#
+# only checks the import of the physics core (CORE_MODULES) in a new interpreter: it must not load any drawing or
+# symbolic library (HEAVY_MODULES) and must take less than IMPORT_BUDGET on top of numpy.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from config import IMPORT_BUDGET
+from integrators import INTEGRATORS
+from scenes import BENCHMARK_SCENES
+from simulator import Simulation
+
+SIZES = (10, 100, 1000, 10000, 100000)
+CORE_MODULES = ("points", "engine", "forces", "forces.contact", "forces.curve_restriction", "forces.gravitation",
+                "integrators", "islands", "spatial", "simulator", "scenes", "scenefile", "headless")
+HEAVY_MODULES = ("matplotlib", "sympy", "scipy")
+IMPORT_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import numpy
+middle = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+end = time.perf_counter()
+print(json.dumps({"numpy_s": middle - start, "core_s": end - middle, "modules": sorted(sys.modules)}))
+"""
+
+
+def version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def import_time(modules: tuple[str, ...] = CORE_MODULES, repeat: int = 5) -> dict[str, Any]:
+    # Best of repeat imports in new interpreters, with the heavy modules they loaded
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT_CODE, *modules], capture_output=True, text=True,
+                             check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(out))
+    heavy = sorted({m for m in runs[0]["modules"] if m.split(".")[0] in HEAVY_MODULES})
+    return {
+        "numpy_s": min(r["numpy_s"] for r in runs),
+        "core_s": min(r["core_s"] for r in runs),
+        "heavy_modules": heavy,
+    }
+
+
+def check_imports(budget: float = IMPORT_BUDGET) -> bool:
+    imports = import_time()
+    print(f"import of the core: {1e3 * imports['core_s']:.1f} ms on top of numpy ({1e3 * imports['numpy_s']:.1f} "
+          f"ms), budget {1e3 * budget:.0f} ms")
+    ok = imports["core_s"] <= budget
+    if imports["heavy_modules"]:
+        print("loaded by the core: " + ", ".join(imports["heavy_modules"]))
+        ok = False
+    return ok
+
+
+def time_steps(sim: Simulation, budget: float) -> tuple[int, float]:
+    # At least one step, then as many as fit in the budget
+    steps = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while steps == 0 or elapsed < budget:
+        sim.step()
+        steps += 1
+        elapsed = time.perf_counter() - start
+    return steps, elapsed
+
+
+def time_draw(sim: Simulation, budget: float, batch: bool) -> tuple[float, float]:
+    import matplotlib.pyplot as plt
+
+    sim.batch_draw = batch
+    fig, ax = plt.subplots()
+    p = np.array([pt.p for pt in sim.points + sim.updatable_points])
+    ax.set_aspect(1.0)
+    ax.set_xlim(p.real.min() - 1, p.real.max() + 1)
+    ax.set_ylim(p.imag.min() - 1, p.imag.max() + 1)
+    sim.init_draw()
+    fig.canvas.draw()
+
+    frames = 0
+    update = render = 0.0
+    while frames == 0 or update + render < budget:
+        start = time.perf_counter()
+        sim.draw()
+        middle = time.perf_counter()
+        fig.canvas.draw()
+        update += middle - start
+        render += time.perf_counter() - middle
+        frames += 1
+    plt.close(fig)
+    return update / frames, render / frames
+
+
+def peak_memory(factory: Callable[..., Simulation], size: int, **kwargs) -> float:
+    tracemalloc.start()
+    sim = factory(size, **kwargs)
+    sim.init()
+    sim.step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def bench(scene: str, size: int, budget: float, draw: str, memory: bool, **kwargs) -> dict[str, Any]:
+    factory = BENCHMARK_SCENES[scene]
+    start = time.perf_counter()
+    sim = factory(size, **kwargs)
+    sim.init()
+    build = time.perf_counter() - start
+
+    steps, elapsed = time_steps(sim, budget)
+    result = {
+        "scene": scene,
+        "size": size,
+        "integrator": sim.integrator.name,
+        "points": len(sim.points) + len(sim.updatable_points),
+        "forces": len(sim.forces) + len(sim.post_update_force),
+        "build_s": build,
+        "substeps_per_s": steps / elapsed,
+        "physics_frame_s": sim.pres * elapsed / steps,
+    }
+    if draw != "none":
+        result["draw_frame_s"], result["render_frame_s"] = time_draw(sim, budget, draw == "batch")
+    if memory:
+        result["peak_memory_mb"] = peak_memory(factory, size, **kwargs)
+    return result
+
+
+def compare(results: list[dict[str, Any]], path: str) -> None:
+    with open(path) as f:
+        other = {(r["scene"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"speedup against {path} (> 1: faster now)")
+    for r in results:
+        o = other.get((r["scene"], r["size"]))
+        if o is None:
+            continue
+        ratios = [f"substeps {r['substeps_per_s'] / o['substeps_per_s']:.2f}"]
+        for key in ("draw_frame_s", "render_frame_s"):
+            if key in r and key in o:
+                ratios.append(f"{key[:-8]} {o[key] / r[key]:.2f}")
+        if "peak_memory_mb" in r and "peak_memory_mb" in o:
+            ratios.append(f"memory {o['peak_memory_mb'] / r['peak_memory_mb']:.2f}")
+        print(f"{r['scene']:<20}{r['size']:>8}  " + "  ".join(ratios))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the simulator over scenes of growing size.")
+    parser.add_argument("--scenes", default=",".join(BENCHMARK_SCENES),
+                        help=f"comma separated list among {', '.join(BENCHMARK_SCENES)}")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated numbers of points")
+    parser.add_argument("--budget", type=float, default=1.0, help="time spent on each measure (s)")
+    parser.add_argument("--objects", action="store_true", help="use the object engine instead of the array one")
+    parser.add_argument("--integrator", choices=INTEGRATORS, default=None,
+                        help="integrator of every scene (default: the one of each scene, euler for most)")
+    parser.add_argument("--pres", type=int, default=50, help="substeps per frame")
+    parser.add_argument("--draw", choices=("batch", "legacy", "none"), default="batch",
+                        help="renderer to measure (legacy: one artist per object)")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory")
+    parser.add_argument("--compare", metavar="PATH", help="results of another version to compare with")
+    parser.add_argument("--imports", action="store_true", help="only check the import time of the physics core")
+    parser.add_argument("-o", "--output", help="default: benchmarks/<git describe>.json")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        sys.exit(0 if check_imports() else 1)
+
+    if args.draw != "none":
+        import matplotlib
+
+        matplotlib.use("Agg")
+
+    kwargs = {"pres": args.pres, "vectorized": not args.objects}
+    if args.integrator is not None:
+        kwargs["integrator"] = args.integrator
+    results = []
+    for scene in args.scenes.split(","):
+        for size in map(int, args.sizes.split(",")):
+            r = bench(scene, size, args.budget, args.draw, not args.no_memory, **kwargs)
+            results.append(r)
+            print(f"{scene:<20}{size:>8}  {r['substeps_per_s']:>10.0f} substeps/s  "
+                  f"physics {1e3 * r['physics_frame_s']:>9.2f} ms/frame"
+                  + (f"  draw {1e3 * r['draw_frame_s']:>8.2f} + {1e3 * r['render_frame_s']:>8.2f} ms/frame"
+                     if "draw_frame_s" in r else "")
+                  + (f"  peak {r['peak_memory_mb']:>8.1f} MiB" if "peak_memory_mb" in r else ""), flush=True)
+
+    name = version()
+    output = args.output or os.path.join("benchmarks", name + ".json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "version": name,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "imports")},
+            "imports": import_time(),
+            "results": results,
+        }, f, indent=1)
+    print(f"saved in {output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
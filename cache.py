@@ -0,0 +1,176 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Results of headless runs (headless.run) kept on disk and found again by a hash of everything they depend on
+# (scene_key): the source of the physics, the settings of the simulation, its current state (checkpoint.collect)
+# and the parameters of its points and forces (Point.parameters, Force.parameters). An entry holds the recorded
+# trajectory and a checkpoint of the last step: a run of the same scene and settings replays it, a longer run
+# starts from it. The least recently used entries are removed once the cache gets larger than its size limit.
+import glob
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Any, Optional, TYPE_CHECKING
+
+import numpy as np
+
+from checkpoint import collect
+from points import Point
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+# Sources the results depend on, relative to this file
+SOURCES = ("config.py", "drivers.py", "engine.py", "headless.py", "integrators.py", "islands.py", "points.py",
+           "simulator.py", "spatial.py", "forces/*.py")
+CHECKPOINT = "checkpoint/"
+NUMBERS = (np.generic, bool, int, float, complex)
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    root = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for pattern in SOURCES:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def encode(h: "hashlib._Hash", x: Any, index: dict[int, int]) -> None:
+    # Canonical bytes of a parameter, the points being replaced by their index in the simulation
+    if isinstance(x, Point):
+        if id(x) not in index:
+            raise ValueError(f"{x!r} is not part of the simulation")
+        h.update(b"P%d;" % index[id(x)])
+    elif isinstance(x, np.ndarray) and x.dtype != object:
+        h.update(f"A{x.dtype.str}{x.shape};".encode())
+        h.update(np.ascontiguousarray(x).tobytes())
+    elif isinstance(x, (list, tuple, np.ndarray)):
+        if len(x) and isinstance(x[0], Point):
+            idx = np.fromiter((index.get(id(y), -1) for y in x), dtype=np.int64, count=len(x))
+            if (idx < 0).any():
+                raise ValueError("some points of a force are not part of the simulation")
+            encode(h, idx, index)
+            return
+        if len(x) and isinstance(x[0], NUMBERS):
+            values = np.asarray(x)
+            if values.dtype.kind in "biufc":
+                encode(h, values, index)
+                return
+        h.update(b"[")
+        for y in x:
+            encode(h, y, index)
+        h.update(b"]")
+    elif isinstance(x, NUMBERS + (str,)) or x is None:
+        h.update(f"{type(x).__name__}:{x.item() if isinstance(x, np.generic) else x!r};".encode())
+    elif callable(x):
+        h.update(f"F{x.__qualname__};".encode())
+    else:
+        # Curves, grids: their class and attributes
+        h.update(f"O{type(x).__name__}{{".encode())
+        for name, y in sorted(vars(x).items()):
+            h.update(name.encode())
+            encode(h, y, index)
+        h.update(b"}")
+
+
+def scene_key(sim: "Simulation") -> str:
+    h = hashlib.sha256(code_version().encode())
+    # frames: the steps of headless.run are whole frames
+    settings = {"pres": sim.pres, "interval": sim.interval, "dt": sim.dt, "adaptive": sim.adaptive,
+                "tolerance": sim.tolerance, "sleeping": sim.sleeping, "frames": sim.adaptive or bool(sim.workers)}
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    arrays = collect(sim)
+    for name in sorted(arrays):
+        h.update(name.encode())
+        encode(h, arrays[name], {})
+
+    points = sim.points + sim.updatable_points
+    index = {id(p): i for i, p in enumerate(points)}
+    # The parameters of the points class by class, each one for all of them at once
+    types = [type(p) for p in points]
+    h.update("\n".join(cls.__name__ for cls in types).encode())
+    for cls in sorted(set(types), key=lambda cls: cls.__name__):
+        members = [p for p, t in zip(points, types) if t is cls]
+        for name in cls.parameters:
+            h.update(name.encode())
+            encode(h, [getattr(p, name, None) for p in members], index)
+    for f in sim.forces + sim.post_update_force:
+        h.update(type(f).__name__.encode())
+        for name in f.parameters:
+            h.update(name.encode())
+            encode(h, getattr(f, name, None), index)
+    return h.hexdigest()
+
+
+class ResultCache:
+    # One npz file per entry, named <key>-<record_every>-<steps>.npz: the result of headless.run and the checkpoint
+    # of the last step (CHECKPOINT entries). The modification time of a file is the time of its last use.
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str, record_every: int, steps: int) -> str:
+        return os.path.join(self.directory, f"{key}-{record_every}-{steps}.npz")
+
+    def lookup(self, key: str, record_every: int, steps: int,
+               prefix: bool = True) -> Optional[tuple[int, dict[str, np.ndarray]]]:
+        # The entry of these steps or, with prefix, the longest shorter one with a checkpoint whose records are
+        # aligned with the ones of the whole run
+        path = self.path(key, record_every, steps)
+        if not os.path.exists(path):
+            if not prefix:
+                return None
+            path = None
+            for p in glob.glob(os.path.join(self.directory, f"{key}-{record_every}-*.npz")):
+                n = int(p[:-4].rsplit("-", 1)[1])
+                if n < steps and (record_every == 0 or n % record_every == 0) and \
+                        (path is None or n > found) and self.has_checkpoint(p):
+                    path, found = p, n
+            if path is None:
+                return None
+        else:
+            found = steps
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        os.utime(path)
+        return found, arrays
+
+    @staticmethod
+    def has_checkpoint(path: str) -> bool:
+        # Only reads the list of arrays
+        with np.load(path) as data:
+            return CHECKPOINT + "meta" in data.files
+
+    def store(self, key: str, record_every: int, steps: int, result: dict[str, np.ndarray],
+              checkpoint: dict[str, np.ndarray]) -> None:
+        path = self.path(key, record_every, steps)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **result, **{CHECKPOINT + name: value for name, value in checkpoint.items()})
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for p in glob.glob(os.path.join(self.directory, "*.npz")):
+            stat = os.stat(p)
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(p)
+            total -= size
+
+    @staticmethod
+    def split(arrays: dict[str, np.ndarray]) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        # Result and checkpoint of an entry
+        result = {name: value for name, value in arrays.items() if not name.startswith(CHECKPOINT)}
+        checkpoint = {name[len(CHECKPOINT):]: value for name, value in arrays.items() if name.startswith(CHECKPOINT)}
+        return result, checkpoint
@@ -0,0 +1,209 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Checkpoints of a running simulation: the state of every point, the saved attributes of the points and forces
+# (Point.saved, Force.saved), the time, frame_id, the integrator state (Integrator.save) and the sleeping islands,
+# in one uncompressed npz file. A simulation built from the same scene and restored from a checkpoint continues
+# bit for bit as the original one, so that a long run can be resumed after a crash and many variants can start
+# from a single warmed-up state.
+#
+#   sim.checkpointer = Checkpointer("run.npz", every=5000)   # while running
+#   restore(sim, "run.npz")                                  # in a new process, sim built from the same scene
+import json
+import os
+import threading
+from typing import Optional, TYPE_CHECKING, Union
+
+import numpy as np
+
+from points import MassPoint
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+FORMAT = 2
+STATE_FIELDS = ("p", "v", "a", "ca", "m", "inv_m", "init_p", "init_v")
+POINT_FIELDS = ("p", "v", "a", "ca")
+# The object engine mixes python and numpy numbers, whose arithmetic differ in the last bit: their type is kept
+NUMBER_TYPES = (complex, np.complex128, int, float, np.float64)
+SCALARS = ("t", "frame_id", "steps", "adaptive_dt", "rejected_steps", "island_steps")
+
+
+def all_points(sim: "Simulation") -> list:
+    return sim.points + sim.updatable_points
+
+
+def snapshot(sim: "Simulation") -> dict[str, np.ndarray]:
+    # Copy of everything a checkpoint holds, cheap enough to be taken in the step loop
+    if sim.parallel is not None:
+        raise ValueError("the integrators of the worker processes cannot be saved, no checkpoint with workers")
+    return collect(sim)
+
+
+def collect(sim: "Simulation") -> dict[str, np.ndarray]:
+    # Same as snapshot, without the state kept by the worker processes
+    points = all_points(sim)
+    forces = sim.forces + sim.post_update_force
+    arrays: dict[str, np.ndarray] = {}
+    meta = {
+        "format": FORMAT,
+        "points": len(points),
+        "forces": [type(f).__name__ for f in forces],
+        "integrator": sim.integrator.name,
+        "vectorized": sim.state is not None,
+        "batch_shape": list(sim.state.batch_shape) if sim.state is not None else [],
+        **{name: getattr(sim, name) for name in SCALARS},
+    }
+
+    if sim.state is not None:
+        for name in STATE_FIELDS:
+            arrays["state/" + name] = getattr(sim.state, name).copy()
+    else:
+        for name in POINT_FIELDS:
+            values = [getattr(p, name, 0) for p in points]
+            arrays["points/" + name] = np.array(values, dtype=complex)
+            arrays["points/" + name + "/type"] = np.array([NUMBER_TYPES.index(type(x)) for x in values], dtype=np.int8)
+
+    for i, p in enumerate(points):
+        for name in p.saved:
+            arrays[f"point/{i}/{name}"] = np.array(getattr(p, name))
+    for i, f in enumerate(forces):
+        for name in f.saved:
+            value = getattr(f, name, None)
+            if value is not None:
+                arrays[f"force/{i}/{name}"] = np.array(value)
+    for name, value in sim.integrator.save().items():
+        arrays["integrator/" + name] = value
+    if sim.islands is not None:
+        arrays["islands/awake"] = sim.islands.awake.copy()
+        arrays["islands/calm"] = sim.islands.calm.copy()
+    arrays["meta"] = np.array(json.dumps(meta))
+    return arrays
+
+
+def write(path: str, arrays: dict[str, np.ndarray]) -> None:
+    # Written next to path then renamed: a crash while writing leaves the previous checkpoint intact
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def save(sim: "Simulation", path: str) -> None:
+    write(path, snapshot(sim))
+
+
+def read(path: str) -> dict[str, np.ndarray]:
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def restore(sim: "Simulation", checkpoint: Union[str, dict[str, np.ndarray]]) -> None:
+    # sim must be built from the same scene, with the same integrator
+    if sim.parallel is not None:
+        raise ValueError("the integrators of the worker processes cannot be restored, no checkpoint with workers")
+    arrays = read(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    meta = json.loads(str(arrays["meta"]))
+    points = all_points(sim)
+    forces = sim.forces + sim.post_update_force
+    if meta["format"] != FORMAT:
+        raise ValueError(f"checkpoint format {meta['format']}, expected {FORMAT}")
+    if meta["points"] != len(points) or meta["forces"] != [type(f).__name__ for f in forces]:
+        raise ValueError("the checkpoint was not taken from the same scene")
+    if meta["integrator"] != sim.integrator.name:
+        raise ValueError(f"the checkpoint was taken with the {meta['integrator']} integrator, not "
+                         f"{sim.integrator.name}")
+
+    if meta["vectorized"]:
+        sim.vectorize()
+        if list(sim.state.batch_shape) != meta["batch_shape"]:
+            raise ValueError(f"the checkpoint has a batch of shape {tuple(meta['batch_shape'])}")
+    elif sim.state is not None:
+        raise ValueError("the checkpoint was taken without the array engine")
+    if "islands/awake" in arrays and sim.islands is None:
+        # Builds the islands before the state is restored, init resets it
+        sim.sleeping = True
+        sim.init()
+
+    if meta["vectorized"]:
+        for name in STATE_FIELDS:
+            np.copyto(getattr(sim.state, name), arrays["state/" + name])
+    else:
+        for name in POINT_FIELDS:
+            values = arrays["points/" + name].tolist()
+            types = arrays["points/" + name + "/type"].tolist()
+            for p, value, i in zip(points, values, types):
+                if name == "p" or isinstance(p, MassPoint):
+                    setattr(p, name, NUMBER_TYPES[i](value if NUMBER_TYPES[i] in (complex, np.complex128) else
+                                                     value.real))
+
+    for key, value in arrays.items():
+        kind, _, rest = key.partition("/")
+        if kind in ("point", "force"):
+            i, name = rest.split("/")
+            setattr((points if kind == "point" else forces)[int(i)], name, value.item() if value.ndim == 0 else value)
+    for name in SCALARS:
+        setattr(sim, name, meta[name])
+    sim.bind_drivers()
+
+    # The forces are bound again, with the restored parameters and the restored sleeping islands
+    if "islands/awake" in arrays:
+        np.copyto(sim.islands.awake, arrays["islands/awake"])
+        np.copyto(sim.islands.calm, arrays["islands/calm"])
+        sim.refresh_active()
+    elif sim.state is not None:
+        sim.bind_forces(sim.forces, sim.post_update_force)
+    sim.integrator.load(sim, {key[11:]: value for key, value in arrays.items() if key.startswith("integrator/")})
+
+
+class Checkpointer:
+    # Takes a snapshot every `every` steps (every frame in adaptive mode) and writes it in a background
+    # thread: the step loop only pays for the copy. If the writer falls behind, only the last snapshot is written.
+    # path may contain {step}, sim.steps (restored with the checkpoint), to keep one file per checkpoint instead of
+    # replacing it.
+    def __init__(self, path: str, every: int = 1000) -> None:
+        self.path = path
+        self.every = every
+        self.written = 0
+        self.pending: Optional[tuple[str, dict[str, np.ndarray]]] = None
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def step(self, sim: "Simulation") -> None:
+        if sim.steps % self.every == 0:
+            self.save(sim)
+
+    def save(self, sim: "Simulation") -> None:
+        if self.error is not None:
+            raise self.error
+        arrays = snapshot(sim)
+        with self.condition:
+            self.pending = (self.path.format(step=sim.steps), arrays)
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                path, arrays = self.pending
+                self.pending = None
+            try:
+                write(path, arrays)
+                self.written += 1
+            except BaseException as e:
+                self.error = e
+
+    def close(self) -> None:
+        # Waits for the last snapshot to be written
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -9,6 +9,8 @@ L0 = 1  # m
 M = 0.100  # kg
 K = 0.1  #
 G = 9.81  # m.s⁻²
+G_UNIVERSEL = 6.674e-11  # N.m².kg⁻²
+BARNES_HUT_THETA = 0.5  # angle d'ouverture, 0 : somme exacte
 
 
 TMPS_REEL = 20  # s
@@ -22,6 +24,20 @@ SCALE_K_SIZE = 0.01
 SCALE_VEC_V = 0.1
 SCALE_VEC_A = 0.5
 
+ADAPTIVE_TOL = 1e-5  # m
+ADAPTIVE_MAX_SHRINK = 1000  # pas minimal = dt / ADAPTIVE_MAX_SHRINK
+
+SLEEP_ENERGY = 1e-5  # J, énergie cinétique par point sous laquelle un îlot s'endort
+SLEEP_FRAMES = 30  # nombre d'images consécutives sous SLEEP_ENERGY avant de s'endormir
+
+DECOUPLED = False  # physique dans un thread séparé de l'affichage
+REALTIME_POLICY = "catch-up"  # "catch-up" : rattrape le retard, "drop" : abandonne le temps de retard
+WORKERS = None  # nombre de processus calculant les îlots en parallèle, None : tout dans le processus principal
+IMPORT_BUDGET = 0.1  # s, temps d'import du cœur de la physique en plus de numpy (python benchmark.py --imports)
+CACHE_DIR = None  # dossier des résultats de headless.py gardés sur disque, None : pas de cache
+CACHE_SIZE = 2 ** 30  # octets, au-delà les résultats les moins récemment utilisés sont supprimés
+PROFILE = None  # chemin du fichier json du profil (temps par phase et par force), None : pas de profilage
+
 # Constantes
 INTERVAL = 1000 // FPS
 INTERVAL_S = INTERVAL / 1000
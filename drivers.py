@@ -0,0 +1,84 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Prescribed motions of the DrivenPoint of a simulation, from its time: at the end of each substep, the driver of
+# each class of driven points computes the positions of all of them at once, from arrays of their parameters built
+# when the simulation starts (Simulation.bind_drivers).
+from typing import Optional
+
+import numpy as np
+
+from engine import ArrayState
+from points import DrivenPoint, KeyframePoint, SinusoidalPoint
+
+
+class Driver:
+    def __init__(self, points: list[DrivenPoint], state: Optional[ArrayState]) -> None:
+        self.points = points
+        self.center = np.array([p.center for p in points], dtype=complex)
+        self.idx = None if state is None else state.indices(points)
+        for i, p in enumerate(points):
+            p.driver = self
+            p.driver_id = i
+
+    def motion(self, t: float) -> np.ndarray:
+        # Positions relative to the centers at time t
+        raise NotImplementedError
+
+    def move(self, state: Optional[ArrayState], t: float) -> None:
+        p = self.center + self.motion(t)
+        if self.idx is None:
+            for pt, z in zip(self.points, p.tolist()):
+                pt.p = z
+        else:
+            state.p[..., self.idx] = p
+
+    def unbind(self) -> None:
+        for p in self.points:
+            p.driver = None
+            p.driver_id = -1
+
+
+class SinusoidalDriver(Driver):
+    def __init__(self, points: list[SinusoidalPoint], state: Optional[ArrayState]) -> None:
+        super().__init__(points, state)
+        self.amp = np.array([p.amp for p in points], dtype=complex)
+        self.pulsation = np.array([p.pulsation for p in points], dtype=float)
+        self.cos_fact = np.array([p.cos_fact for p in points], dtype=complex)
+        self.sin_fact = np.array([p.sin_fact for p in points], dtype=complex)
+
+    def motion(self, t: float) -> np.ndarray:
+        wt = self.pulsation * t
+        return self.amp * (self.sin_fact * np.sin(wt) + self.cos_fact * np.cos(wt))
+
+
+# The keyframes of all the points one after the other, the segment of each point is found by a binary search run
+# on all of them at once
+class KeyframeDriver(Driver):
+    def __init__(self, points: list[KeyframePoint], state: Optional[ArrayState]) -> None:
+        super().__init__(points, state)
+        lengths = np.array([len(p.times) for p in points], dtype=np.intp)
+        self.first = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self.last = self.first + lengths - 1
+        self.times = np.concatenate([np.asarray(p.times, dtype=float) for p in points])
+        self.positions = np.concatenate([np.asarray(p.positions, dtype=complex) for p in points])
+        self.start = self.times[self.first]
+        self.period = self.times[self.last] - self.start
+        self.loop = np.array([p.loop for p in points], dtype=bool) & (self.period > 0)
+        self.searches = int(lengths.max(initial=1)).bit_length()
+
+    def motion(self, t: float) -> np.ndarray:
+        t = np.where(self.loop, self.start + np.mod(t - self.start, np.where(self.loop, self.period, 1)), t)
+        lo, hi = self.first, self.last
+        for _ in range(self.searches):
+            mid = (lo + hi) // 2
+            after = self.times[mid] <= t
+            lo = np.where(after, mid, lo)
+            hi = np.where(after, hi, mid)
+        span = self.times[hi] - self.times[lo]
+        frac = np.clip((t - self.times[lo]) / np.where(span > 0, span, 1), 0, 1)
+        return self.positions[lo] + frac * (self.positions[hi] - self.positions[lo])
+
+
+SinusoidalPoint.driver_class = SinusoidalDriver
+KeyframePoint.driver_class = KeyframeDriver
@@ -0,0 +1,136 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+from typing import Iterable, Optional
+
+import numpy as np
+
+from points import MassPoint, Point
+
+
+# Structure of arrays holding the state of every point of a simulation, once bound the points are thin views
+# over their slot. With a batch, every array gets a leading (batch,) dimension: each row is an independent copy
+# of the system and the points show the row `member`.
+class ArrayState:
+    def __init__(self, points: list[Point], batch: Optional[int] = None) -> None:
+        self.points = points
+        self.batch_shape = () if batch is None else (batch,)
+        n = len(points)
+
+        p = np.array([pt.p for pt in points], dtype=complex)
+        v = np.zeros(n, dtype=complex)
+        a = np.zeros(n, dtype=complex)
+        ca = np.zeros(n, dtype=complex)
+        m = np.array([pt.m for pt in points], dtype=float)
+        inv_m = np.zeros(n, dtype=float)
+        init_p = p.copy()
+        init_v = v.copy()
+
+        for i, pt in enumerate(points):
+            if isinstance(pt, MassPoint):
+                v[i] = pt.v
+                a[i] = pt.a
+                ca[i] = pt.ca
+                inv_m[i] = 1 / pt.m
+                init_p[i] = pt.init_p
+                init_v[i] = pt.init_v
+
+        self.allocate(p, v, a, ca, m, inv_m, init_p, init_v)
+        for i, pt in enumerate(points):
+            pt.bind(self, i)
+
+    @classmethod
+    def from_arrays(cls, p: np.ndarray, v: np.ndarray, m: np.ndarray, batch: Optional[int] = None) -> "ArrayState":
+        # State of points given as arrays of initial positions, velocities and masses (0 for the points that are not
+        # MassPoint), without reading any point. The points are bound (or built, see points.point_views) and put
+        # in state.points by the caller, in the order of the arrays.
+        state = cls.__new__(cls)
+        state.points = []
+        state.batch_shape = () if batch is None else (batch,)
+        p = np.asarray(p, dtype=complex)
+        v = np.asarray(v, dtype=complex)
+        m = np.asarray(m, dtype=float)
+        inv_m = np.divide(1, m, out=np.zeros_like(m), where=m > 0)
+        state.allocate(p, v, np.zeros_like(p), np.zeros_like(p), m, inv_m, p, v)
+        return state
+
+    def allocate(self, p, v, a, ca, m, inv_m, init_p, init_v) -> None:
+        shape = self.batch_shape + (len(p),)
+        self.mass_idx = np.flatnonzero(inv_m > 0)
+        self.p = np.broadcast_to(p, shape).copy()
+        self.v = np.broadcast_to(v, shape).copy()
+        self.a = np.broadcast_to(a, shape).copy()
+        self.ca = np.broadcast_to(ca, shape).copy()
+        self.m = np.broadcast_to(m, shape).copy()
+        self.inv_m = np.broadcast_to(inv_m, shape).copy()
+        self.init_p = np.broadcast_to(init_p, shape).copy()
+        self.init_v = np.broadcast_to(init_v, shape).copy()
+        self.show_member(0)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def show_member(self, member: int) -> None:
+        if self.batch_shape:
+            self.view_p, self.view_v, self.view_a, self.view_ca = self.p[member], self.v[member], self.a[member], \
+                self.ca[member]
+        else:
+            self.view_p, self.view_v, self.view_a, self.view_ca = self.p, self.v, self.a, self.ca
+
+    def index_of(self, pt: Point) -> int:
+        if pt.state is not self:
+            raise ValueError(f"{pt!r} is not part of the simulation")
+        return pt.state_id
+
+    def indices(self, points: Iterable[Point]) -> np.ndarray:
+        points = list(points)
+        idx = np.fromiter((pt.state_id if pt.state is self else -1 for pt in points), dtype=np.intp,
+                          count=len(points))
+        if (idx < 0).any():
+            self.index_of(points[int(np.argmax(idx < 0))])
+        return idx
+
+    def stack(self, values: Iterable) -> np.ndarray:
+        # Per force parameters (scalars or arrays of shape (batch,)) as an array of shape batch_shape + (n,)
+        return np.moveaxis(np.array([np.broadcast_to(v, self.batch_shape) for v in values], dtype=float), 0, -1)
+
+    def set_initial(self, pt: MassPoint, p=None, v=None) -> None:
+        i = self.index_of(pt)
+        if p is not None:
+            self.init_p[..., i] = p
+            self.p[..., i] = p
+        if v is not None:
+            self.init_v[..., i] = v
+            self.v[..., i] = v
+
+    def set_mass(self, pt: MassPoint, m) -> None:
+        i = self.index_of(pt)
+        self.m[..., i] = m
+        self.inv_m[..., i] = 1 / self.m[..., i]
+
+    def reset(self) -> None:
+        self.p[..., self.mass_idx] = self.init_p[..., self.mass_idx]
+        self.v[..., self.mass_idx] = self.init_v[..., self.mass_idx]
+        self.a.fill(0)
+        self.ca.fill(0)
+
+    def save(self) -> tuple[np.ndarray, ...]:
+        return self.p.copy(), self.v.copy(), self.a.copy()
+
+    def restore(self, saved: tuple[np.ndarray, ...]) -> None:
+        for array, values in zip((self.p, self.v, self.a), saved):
+            np.copyto(array, values)
+
+    def unbind(self) -> None:
+        for pt in self.points:
+            pt.unbind()
+
+
+def scatter_add(target: np.ndarray, idx: np.ndarray, values: np.ndarray) -> None:
+    n = target.shape[-1]
+    if target.ndim > 1:
+        values = np.broadcast_to(values, target.shape[:-1] + idx.shape)
+        idx = (np.arange(target.shape[0])[:, None] * n + idx).ravel()
+        values = values.ravel()
+        target = target.reshape(-1)
+    size = target.size
+    target += np.bincount(idx, values.real, size) + 1j * np.bincount(idx, values.imag, size)
@@ -1,14 +1,32 @@
 # PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
 # License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
 
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
+from typing import Optional, TYPE_CHECKING
 
+import numpy as np
+
+from engine import scatter_add
 from points import MassPoint
 
+if TYPE_CHECKING:
+    from matplotlib.lines import Line2D
+
+    from engine import ArrayState
+    from points import Point
+
 
 class Force:
     post_update = False
+    batch_class: Optional[type["Force"]] = None
+    show = False
+    batch_drawn = False
+    # Attributes saved with the state of the simulation (checkpoint.py)
+    saved: tuple[str, ...] = ()
+    # Attributes fixed at construction that the results depend on, besides the saved ones (cache.py). The points
+    # are described by their index in the simulation.
+    parameters: tuple[str, ...] = ()
+    # Forces applied to each of self.points during the last step, kept only when shown by a BatchRenderer
+    last_forces: Optional[np.ndarray] = None
 
     def __init__(self):
         pass
@@ -16,6 +34,26 @@ class Force:
     def update(self):
         raise NotImplemented
 
+    def bind(self, state: "ArrayState") -> None:
+        pass
+
+    def update_state(self, state: "ArrayState") -> None:
+        self.update()
+
+    def links(self) -> list[list["Point"]]:
+        # Groups of points whose motions are coupled by the force (see islands.py), all of its points by default
+        points = getattr(self, "points", [])
+        return [points] if points else []
+
+    def restrict(self, points: list["Point"]) -> Optional["Force"]:
+        # Same force acting on a part of its points only (see parallel.py), None if it cannot be split
+        return None
+
+    def touching(self) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        # Pairs of points (indices in self.points) in contact during the last step, for forces creating links on
+        # the fly
+        return None
+
     def draw(self, frame_id: int) -> None:
         pass
 
@@ -24,6 +62,8 @@ class Force:
 
 
 class ForcePoint(Force):
+    parameters = ("points",)
+
     def __init__(self, p: list[MassPoint], show=False, *args, **kwargs):
         super().__init__()
         self.show = show
@@ -34,9 +74,11 @@ class ForcePoint(Force):
     def get_force(self, p: MassPoint):
         return 0
 
-    def init_draw(self, drawables: list[Line2D]):
+    def init_draw(self, drawables: list["Line2D"]):
+        import matplotlib.pyplot as plt
+
         super().init_draw(drawables)
-        if self.show:
+        if self.show and not self.batch_drawn:
             self.d_arrow = [
                 plt.arrow(
                     p.p.real,
@@ -65,12 +107,30 @@ class CurveRestriction(ForcePoint):
     def __init__(self, p: list[MassPoint], *args, **kwargs):
         super().__init__(p, *args, **kwargs)
 
-    def apply_reaction(self, p: MassPoint, n: complex, curvature: int):
+    def apply_reaction(self, p: MassPoint, n: complex, curvature) -> complex:
+        # reactions for a single point, with python numbers
         if n == 0 or curvature == 0 or p.v == 0:
             return 0
         v = abs(p.v)
         unit_vec_normal = n / abs(n)
-        reac = v * v / curvature * unit_vec_normal + (
-                    p.ca.real * v.real + p.ca.imag * v.imag) / v * unit_vec_normal * 1j
+        reac = v * v / curvature * unit_vec_normal + p.ca.real * unit_vec_normal * 1j
         p.ca += reac
         return reac
+
+    @staticmethod
+    def reactions(v: np.ndarray, ca: np.ndarray, n: np.ndarray, curvature) -> np.ndarray:
+        # Reaction applied to points of velocity v and forces ca, n being the direction of the center of curvature
+        # (n = 0 means no reaction)
+        v = np.abs(v)
+        n_abs = np.abs(n)
+        active = (n_abs != 0) & (curvature != 0) & (v != 0)
+        unit_vec_normal = n / np.where(active, n_abs, 1)
+        reac = v * v / np.where(active, curvature, 1) * unit_vec_normal + ca.real * unit_vec_normal * 1j
+        reac[~active] = 0
+        return reac
+
+    def apply_reactions(self, state: "ArrayState", idx: np.ndarray, n: np.ndarray, curvature) -> np.ndarray:
+        # Reactions of the points idx of the state, added to their forces
+        reac = self.reactions(state.v[..., idx], state.ca[..., idx], n, curvature)
+        scatter_add(state.ca, idx, reac)
+        return reac
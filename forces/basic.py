@@ -1,15 +1,19 @@
 # PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
 # License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
-from typing import Union
+from typing import Optional, TYPE_CHECKING, Union
 
 from config import G, SCALE_K, SCALE_K_SIZE, SCALE_R_ZIG_ZAG
-from .abstract import ForcePoint
+from engine import scatter_add
+from .abstract import Force, ForcePoint
 from points import Point, MassPoint
 
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
 import numpy as np
 
+if TYPE_CHECKING:
+    from matplotlib.lines import Line2D
+
+    from engine import ArrayState
+
 
 class Poids(ForcePoint):
     def __init__(self, p: Union[MassPoint, list[MassPoint]], *args, **kwargs):
@@ -23,8 +27,23 @@ class Poids(ForcePoint):
         for p in self.p:
             p.ca += -1j * G * p.m
 
+    def links(self):
+        return []
+
+    def restrict(self, points: list[MassPoint]):
+        return Poids(points)
+
+    def bind(self, state: "ArrayState"):
+        self.idx = state.indices(self.p)
+
+    def update_state(self, state: "ArrayState"):
+        scatter_add(state.ca, self.idx, -1j * G * state.m[..., self.idx])
+
 
 class Ressort(ForcePoint):
+    saved = ("k", "l0")
+    parameters = ("pta", "ptb")
+
     def __init__(
             self, pta: "Point", ptb: "Point", k: float, l0: float, *args, **kwargs
     ):
@@ -42,7 +61,7 @@ class Ressort(ForcePoint):
 
         self.d_nb_points = int(SCALE_K * l0 // k) + 2
 
-        self.d_line: Line2D
+        self.d_line: "Line2D"
 
     def get_force(self, p: MassPoint):
         l = abs(self.pta.p - self.ptb.p) or 1e-10
@@ -59,12 +78,34 @@ class Ressort(ForcePoint):
         if isinstance(self.ptb, MassPoint):
             self.ptb.ca += f
 
-    def init_draw(self, drawables: list[Line2D]):
-        (self.d_line,) = plt.plot([], [], "-", zorder=50)
+    def links(self):
+        return [[self.pta, self.ptb]]
+
+    def bind(self, state: "ArrayState"):
+        self.ia = state.index_of(self.pta)
+        self.ib = state.index_of(self.ptb)
+
+    def update_state(self, state: "ArrayState"):
+        d = state.p[..., self.ia] - state.p[..., self.ib]
+        l = np.abs(d)
+        f = self.k * (l - self.l0) * d / np.where(l == 0, 1e-10, l)
+        if isinstance(self.pta, MassPoint):
+            state.ca[..., self.ia] -= f
+        if isinstance(self.ptb, MassPoint):
+            state.ca[..., self.ib] += f
+
+    def init_draw(self, drawables: list["Line2D"]):
+        import matplotlib.pyplot as plt
+
         super().init_draw(drawables)
-        drawables.append(self.d_line)
+        if not self.batch_drawn:
+            (self.d_line,) = plt.plot([], [], "-", zorder=50)
+            drawables.append(self.d_line)
 
     def draw(self, frame_id: int):
+        if self.batch_drawn:
+            return super().draw(frame_id)
+
         points = []
         t = (self.ptb.p - self.pta.p) / self.d_nb_points or 1e-10
         n = (SCALE_K_SIZE * self.k + SCALE_R_ZIG_ZAG) * t * 1j / abs(t)
@@ -80,7 +121,108 @@ class Ressort(ForcePoint):
         super().draw(frame_id)
 
 
+# Every Ressort of a simulation computed at once (batch_class of Ressort), or springs given as arrays without any
+# Ressort object (from_arrays): the spring i links nodes[a[i]] and nodes[b[i]].
+class RessortNetwork(Force):
+    saved = ("spring_k", "spring_l0")
+    parameters = ("nodes", "a", "b")
+
+    def __init__(self, ressorts: list[Ressort]):
+        super().__init__()
+        self.ressorts = ressorts
+        self.nodes: Optional[list[Point]] = None
+
+    @classmethod
+    def from_arrays(cls, nodes: list[Point], a: np.ndarray, b: np.ndarray, k: np.ndarray,
+                    l0: np.ndarray) -> "RessortNetwork":
+        network = cls([])
+        network.nodes = network.points = nodes
+        network.a = np.asarray(a, dtype=np.intp)
+        network.b = np.asarray(b, dtype=np.intp)
+        network.spring_k = np.broadcast_to(np.asarray(k, dtype=float), network.a.shape)
+        network.spring_l0 = np.broadcast_to(np.asarray(l0, dtype=float), network.a.shape)
+        return network
+
+    def links(self):
+        if self.nodes is None:
+            return []
+        return [[self.nodes[i], self.nodes[j]] for i, j in zip(self.a.tolist(), self.b.tolist())]
+
+    def restrict(self, points: list[Point]):
+        # Springs given as arrays with at least one end among points
+        if self.nodes is None:
+            return None
+        ids = {id(p) for p in points}
+        inside = np.array([id(p) in ids for p in self.nodes], dtype=bool)
+        kept = inside[self.a] | inside[self.b]
+        used = np.unique(np.concatenate((self.a[kept], self.b[kept])))
+        new_index = np.full(len(self.nodes), -1, dtype=np.intp)
+        new_index[used] = np.arange(len(used))
+        return RessortNetwork.from_arrays([self.nodes[i] for i in used], new_index[self.a[kept]],
+                                          new_index[self.b[kept]], self.spring_k[kept], self.spring_l0[kept])
+
+    def update(self):
+        # Without array engine, only for the springs given as arrays
+        p = np.array([pt.p for pt in self.nodes], dtype=complex)
+        d = p[self.a] - p[self.b]
+        l = np.abs(d)
+        l[l == 0] = 1e-10
+        f = self.spring_k * (l - self.spring_l0) * d / l
+        ca = np.zeros(len(p), dtype=complex)
+        scatter_add(ca, np.concatenate((self.b, self.a)), np.concatenate((f, -f)))
+        for pt, c in zip(self.nodes, ca):
+            if isinstance(pt, MassPoint):
+                pt.ca += c
+
+    def bind(self, state: "ArrayState"):
+        if self.nodes is None:
+            self.ia = state.indices(r.pta for r in self.ressorts)
+            self.ib = state.indices(r.ptb for r in self.ressorts)
+            self.k = state.stack(r.k for r in self.ressorts)
+            self.l0 = state.stack(r.l0 for r in self.ressorts)
+            self.movable_a = np.array([isinstance(r.pta, MassPoint) for r in self.ressorts], dtype=bool)
+            self.movable_b = np.array([isinstance(r.ptb, MassPoint) for r in self.ressorts], dtype=bool)
+        else:
+            idx = state.indices(self.nodes)
+            self.ia = idx[self.a]
+            self.ib = idx[self.b]
+            self.k = np.broadcast_to(self.spring_k, state.batch_shape + self.a.shape).copy()
+            self.l0 = np.broadcast_to(self.spring_l0, state.batch_shape + self.a.shape).copy()
+            movable = np.zeros(len(state), dtype=bool)
+            movable[state.mass_idx] = True
+            self.movable_a = movable[self.ia]
+            self.movable_b = movable[self.ib]
+        self.scatter_idx = np.concatenate((self.ib[self.movable_b], self.ia[self.movable_a]))
+
+    def update_state(self, state: "ArrayState"):
+        d = state.p[..., self.ia] - state.p[..., self.ib]
+        l = np.abs(d)
+        l[l == 0] = 1e-10
+        f = self.k * (l - self.l0) * d / l
+        scatter_add(state.ca, self.scatter_idx,
+                    np.concatenate((f[..., self.movable_b], -f[..., self.movable_a]), axis=-1))
+
+    def stiffness(self, state: "ArrayState") -> np.ndarray:
+        # Blocks k (u u^T + max(0, 1 - l0 / l) (I - u u^T)) of -df_a/dp_a, as rows (xx, xy, yx, yy). The compressed
+        # springs term is clamped to keep the implicit system positive definite.
+        d = state.p[self.ia] - state.p[self.ib]
+        l = np.abs(d)
+        l[l == 0] = 1e-10
+        ux = d.real / l
+        uy = d.imag / l
+        s = np.clip(1 - self.l0 / l, 0, None)
+        kxy = self.k * (1 - s) * ux * uy
+        return np.stack((self.k * (ux * ux + s * (1 - ux * ux)), kxy, kxy, self.k * (uy * uy + s * (1 - uy * uy))),
+                        axis=1)
+
+
+Ressort.batch_class = RessortNetwork
+
+
 class FrottementsFluides(ForcePoint):
+    saved = ("k",)
+    parameters = ("p",)
+
     def __init__(self, p: MassPoint, k: float, *args, **kwargs):
         super().__init__([p], *args, **kwargs)
         self.k = k
@@ -88,3 +230,12 @@ class FrottementsFluides(ForcePoint):
 
     def update(self):
         self.p.ca -= self.k * self.p.v
+
+    def links(self):
+        return []
+
+    def bind(self, state: "ArrayState"):
+        self.idx = state.index_of(self.p)
+
+    def update_state(self, state: "ArrayState"):
+        state.ca[..., self.idx] -= self.k * state.v[..., self.idx]
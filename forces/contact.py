@@ -0,0 +1,88 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+from typing import TYPE_CHECKING, Union
+
+import numpy as np
+
+from engine import scatter_add
+from spatial import UniformGrid
+from .abstract import ForcePoint
+from points import MassPoint, Point
+
+if TYPE_CHECKING:
+    from engine import ArrayState
+
+
+# Contact between disks of radius r centred on the points: two disks that overlap by d are pushed apart by
+# k d (penalty), plus damping * the speed at which they get closer, the disks never pulling each other. The pairs
+# are found with a uniform grid (broad phase), only the points of neighbour cells are compared. Fixed points are
+# obstacles.
+class Contact(ForcePoint):
+    saved = ("k", "damping", "radius", "pairs")
+
+    def __init__(self, p: list[Point], radius: Union[float, list[float]], k: float, damping: float = 0, *args,
+                 **kwargs):
+        super().__init__(p, *args, **kwargs)
+        self.radius = np.broadcast_to(np.asarray(radius, dtype=float), (len(p),)).copy()
+        self.k = k
+        self.damping = damping
+        self.movable = np.array([isinstance(pt, MassPoint) for pt in p], dtype=bool)
+        self.grid = UniformGrid(2 * self.radius.max(initial=0) or 1)
+        self.forces = np.zeros(len(p), dtype=complex)
+        self.nb_contacts = 0
+        self.index = {id(pt): i for i, pt in enumerate(p)}
+        self.pairs = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+    def compute(self, p: np.ndarray, v: np.ndarray) -> np.ndarray:
+        self.grid.build(p)
+        i, j = self.grid.pairs(self.grid.cell)
+        d = p[i] - p[j]
+        l = np.abs(d)
+        overlap = self.radius[i] + self.radius[j] - l
+        touching = (overlap > 0) & (self.movable[i] | self.movable[j])
+        i, j, d, l, overlap = i[touching], j[touching], d[touching], l[touching], overlap[touching]
+        self.nb_contacts = len(i)
+        self.pairs = (i, j)
+
+        n = d / np.where(l == 0, 1, l)
+        closing = -(v[i] - v[j]).real * n.real - (v[i] - v[j]).imag * n.imag
+        f = np.maximum(self.k * overlap + self.damping * closing, 0) * n
+
+        forces = np.zeros(len(p), dtype=complex)
+        scatter_add(forces, i, f)
+        scatter_add(forces, j, -f)
+        forces[~self.movable] = 0
+        return forces
+
+    def links(self):
+        # Contacts only link points while they touch
+        return []
+
+    def touching(self):
+        return self.pairs
+
+    def get_force(self, p: MassPoint):
+        return self.forces[..., self.index[id(p)]]
+
+    def update(self):
+        p = np.array([pt.p for pt in self.points], dtype=complex)
+        v = np.array([pt.v if isinstance(pt, MassPoint) else 0 for pt in self.points], dtype=complex)
+        self.forces = self.compute(p, v)
+        for pt, f in zip(self.points, self.forces):
+            if f != 0:
+                pt.ca += f
+
+    def bind(self, state: "ArrayState"):
+        self.idx = state.indices(self.points)
+
+    def update_state(self, state: "ArrayState"):
+        p = state.p[..., self.idx]
+        v = state.v[..., self.idx]
+        if not state.batch_shape:
+            self.forces = self.compute(p, v)
+        else:
+            # One grid per member of the ensemble
+            self.forces = np.zeros_like(p)
+            for member in np.ndindex(*state.batch_shape):
+                self.forces[member] = self.compute(p[member], v[member])
+        state.ca[..., self.idx] += self.forces
@@ -1,31 +1,390 @@
-from cmath import phase
+from typing import Callable, Optional, TYPE_CHECKING
 
-from sympy import Line2D
+import numpy as np
 
+from engine import scatter_add
 from forces.abstract import CurveRestriction
 from points import MassPoint, Point
+from spatial import UniformGrid
+
+if TYPE_CHECKING:
+    from matplotlib.lines import Line2D
+
+    from engine import ArrayState
+
+DRAW_LENGTH = 100  # drawn length of each half of an infinite line
+BLOCK = 1024  # points projected at once on every segment of a polyline
+SCALAR_POINTS = 16  # CircleRestriction.update goes point by point below this number of points, with python numbers
 
 
 class CircleRestriction(CurveRestriction):
-    d_line: Line2D
+    d_line: "Line2D"
+    saved = ("radius",)
+    parameters = ("center", "points")
+
     def __init__(self, center: Point, p: list[MassPoint], radius: int, *args, **kwargs):
         super().__init__(p, *args, **kwargs)
         self.center = center
         self.radius = radius
 
     def update(self) -> None:
-        for p in self.points:
-            rel_p = (self.center.p - p.p)
-            rel_p_abs = abs(rel_p)
-            if rel_p_abs >= self.radius:
-                reac = self.apply_reaction(p, rel_p, self.radius)
-                p.p = self.center.p - self.radius * rel_p / abs(rel_p)
+        center = self.center.p
+        if len(self.points) < SCALAR_POINTS:
+            for p in self.points:
+                rel_p = center - p.p
+                rel_p_abs = abs(rel_p)
+                if rel_p_abs >= self.radius:
+                    reac = self.apply_reaction(p, rel_p, self.radius)
+                    p.p = center - self.radius * rel_p / rel_p_abs
+                    if isinstance(self.center, MassPoint):
+                        self.center.ca -= reac
+            return
+
+        p = np.array([pt.p for pt in self.points], dtype=complex)
+        rel_p = center - p
+        rel_p_abs = np.abs(rel_p)
+        out = rel_p_abs >= self.radius
+        if not out.any():
+            return
+
+        v = np.array([pt.v for pt in self.points], dtype=complex)
+        ca = np.array([pt.ca for pt in self.points], dtype=complex)
+        reac = self.reactions(v, ca, np.where(out, rel_p, 0), self.radius)
+        new_p = center - self.radius * rel_p / np.where(out, rel_p_abs, 1)
+        for i in np.flatnonzero(out):
+            self.points[i].ca += reac[i]
+            self.points[i].p = new_p[i]
+
+        if isinstance(self.center, MassPoint):
+            self.center.ca -= reac.sum()
+
+    def links(self):
+        return [[self.center] + self.points]
 
-                if isinstance(self.center, MassPoint):
-                    self.center.ca -= reac
+    def bind(self, state: "ArrayState"):
+        self.idx = state.indices(self.points)
+        self.center_idx = state.indices([self.center])
+        self.r = np.expand_dims(np.asarray(self.radius, dtype=float), -1)
 
+    def update_state(self, state: "ArrayState"):
+        center = state.p[..., self.center_idx]
+        rel_p = center - state.p[..., self.idx]
+        rel_p_abs = np.abs(rel_p)
+        out = rel_p_abs >= self.r
+        if not out.any():
+            return
 
-    def init_draw(self, drawables: list[Line2D]):
+        reac = self.apply_reactions(state, self.idx, np.where(out, rel_p, 0), self.r)
+        state.p[..., self.idx] = np.where(out, center - self.r * rel_p / np.where(out, rel_p_abs, 1),
+                                          state.p[..., self.idx])
+        if isinstance(self.center, MassPoint):
+            state.ca[..., self.center_idx] -= reac.sum(axis=-1, keepdims=True)
+
+    def init_draw(self, drawables: list["Line2D"]):
         super().init_draw(drawables)
     def draw(self, frame_id: int):
         pass
+
+
+# Curves for CurveConstraint, in the frame of its anchor. project(p) gives, for a 1d array of points, the closest
+# point of the curve, the unit tangent there, the signed curvature (> 0 when the curve turns left) and whether
+# the closest point is the first (-1) or last (1) end of an open curve (0 otherwise).
+class Curve:
+    def project(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def path(self) -> np.ndarray:
+        raise NotImplementedError
+
+
+class Line(Curve):
+    def __init__(self, origin: complex = 0, direction: complex = 1):
+        self.origin = origin
+        self.u = direction / abs(direction)
+
+    def project(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        t = ((p - self.origin) * np.conj(self.u)).real
+        return self.origin + t * self.u, np.full(len(p), self.u), np.zeros(len(p)), np.zeros(len(p), dtype=int)
+
+    def path(self) -> np.ndarray:
+        return self.origin + self.u * np.array([-DRAW_LENGTH, DRAW_LENGTH])
+
+
+class Circle(Curve):
+    def __init__(self, radius: float, center: complex = 0):
+        self.radius = radius
+        self.center = center
+
+    def project(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        rel = p - self.center
+        rel_abs = np.abs(rel)
+        u = np.where(rel_abs == 0, 1, rel / np.where(rel_abs == 0, 1, rel_abs))
+        return self.center + self.radius * u, 1j * u, np.full(len(p), 1 / self.radius), np.zeros(len(p), dtype=int)
+
+    def path(self) -> np.ndarray:
+        return self.center + self.radius * np.exp(2j * np.pi * np.linspace(0, 1, 200))
+
+
+class Polyline(Curve):
+    # Arc length (s) and curvature (kappa) are tabulated at the vertices, the curvature being interpolated along
+    # the segments (0 for a polyline, corners are not smoothed).
+    def __init__(self, vertices, closed: bool = False):
+        v = np.asarray(vertices, dtype=complex)
+        self.closed = closed
+        self.vertices = np.append(v, v[:1]) if closed else v
+        self.a = self.vertices[:-1]
+        self.d = np.diff(self.vertices)
+        self.lengths = np.abs(self.d)
+        self.s = np.concatenate(([0], np.cumsum(self.lengths)))
+        self.kappa = np.zeros(len(self.vertices))
+
+    @property
+    def length(self) -> float:
+        return self.s[-1]
+
+    def locate(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Closest segment k of each point and the position t in [0, 1] of the projection along it
+        k = np.empty(len(p), dtype=np.intp)
+        t = np.empty(len(p))
+        len2 = np.where(self.lengths == 0, 1, self.lengths ** 2)
+        for start in range(0, len(p), BLOCK):
+            rel = p[start:start + BLOCK, None] - self.a
+            ts = np.clip((rel * np.conj(self.d)).real / len2, 0, 1)
+            k_block = np.argmin(np.abs(rel - ts * self.d), axis=1)
+            k[start:start + BLOCK] = k_block
+            t[start:start + BLOCK] = ts[np.arange(len(k_block)), k_block]
+        return k, t
+
+    def arc_length(self, p: np.ndarray) -> np.ndarray:
+        k, t = self.locate(p)
+        return self.s[k] + t * self.lengths[k]
+
+    def project(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        k, t = self.locate(p)
+        tangent = self.d[k] / np.where(self.lengths[k] == 0, 1, self.lengths[k])
+        end = np.zeros(len(p), dtype=int)
+        if not self.closed:
+            end[(k == 0) & (t == 0)] = -1
+            end[(k == len(self.d) - 1) & (t == 1)] = 1
+        return self.a[k] + t * self.d[k], tangent, (1 - t) * self.kappa[k] + t * self.kappa[k + 1], end
+
+    def path(self) -> np.ndarray:
+        return self.vertices
+
+
+class Segment(Polyline):
+    def __init__(self, a: complex, b: complex):
+        super().__init__([a, b])
+
+
+class ParametricCurve(Polyline):
+    # t -> f(t) (complex, vectorised) sampled on [t0, t1]. The curvature table comes from the derivatives of the
+    # samples. The closest sample of a point is found with a uniform grid, then only its two segments are tried.
+    def __init__(self, f: Callable[[np.ndarray], np.ndarray], t0: float, t1: float, samples: int = 1000,
+                 closed: bool = False):
+        t = np.linspace(t0, t1, samples, endpoint=not closed)
+        z = np.asarray(f(t), dtype=complex)
+        super().__init__(z, closed)
+
+        if closed:
+            dt = t[1] - t[0]
+            z1 = (np.roll(z, -1) - np.roll(z, 1)) / (2 * dt)
+            z2 = (np.roll(z, -1) - 2 * z + np.roll(z, 1)) / dt ** 2
+        else:
+            z1 = np.gradient(z, t)
+            z2 = np.gradient(z1, t)
+        kappa = (np.conj(z1) * z2).imag / np.abs(z1) ** 3
+        self.kappa = np.append(kappa, kappa[:1]) if closed else kappa
+        self.grid = UniformGrid(self.lengths.max(initial=0) or 1, self.vertices[:len(z)])
+
+    def locate(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        nearest = self.grid.nearest_all(p, self.grid.cell)
+        far = nearest < 0
+        k = np.empty(len(p), dtype=np.intp)
+        t = np.empty(len(p))
+        if far.any():
+            k[far], t[far] = super().locate(p[far])
+
+        # Segments before and after the closest sample
+        near = ~far
+        n = len(self.d)
+        k_after = np.minimum(nearest[near], n - 1)
+        k_before = (nearest[near] - 1) % n if self.closed else np.maximum(nearest[near] - 1, 0)
+        best_d = None
+        for ks in (k_before, k_after):
+            rel = p[near] - self.a[ks]
+            ts = np.clip((rel * np.conj(self.d[ks])).real / np.where(self.lengths[ks] == 0, 1, self.lengths[ks] ** 2),
+                         0, 1)
+            d = np.abs(rel - ts * self.d[ks])
+            if best_d is None:
+                best_d, best_k, best_t = d, ks, ts
+            else:
+                closer = d < best_d
+                best_k = np.where(closer, ks, best_k)
+                best_t = np.where(closer, ts, best_t)
+        k[near] = best_k
+        t[near] = best_t
+        return k, t
+
+
+# Keeps its points on a curve, like beads on a wire: the points are moved to their projection on the curve and
+# their velocity (relative to the anchor) is made tangent. The reaction cancels the normal part of the forces
+# already applied and gives the centripetal force m v^2 kappa. At the ends of an open curve, the points are
+# stopped as by a wall. The curve is in the frame of anchor (absolute without one), a MassPoint anchor takes the
+# opposite of the reactions, as the center of a CircleRestriction.
+class CurveConstraint(CurveRestriction):
+    parameters = ("curve", "points", "anchor")
+
+    def __init__(self, curve: Curve, p: list[MassPoint], anchor: Optional[Point] = None, *args, **kwargs):
+        super().__init__(p, *args, **kwargs)
+        self.curve = curve
+        self.anchor = anchor
+        self.d_line: Optional["Line2D"] = None
+
+    def solve(self, origin, p: np.ndarray, v: np.ndarray, ca: np.ndarray, m: np.ndarray, v_origin=0):
+        shape = p.shape
+        q, tangent, kappa, end = (x.reshape(shape) for x in self.curve.project(np.ravel(p - origin)))
+        normal = 1j * tangent
+        v_t = ((v - v_origin) * np.conj(tangent)).real
+        ca_n = (ca * np.conj(normal)).real
+        reac = (m * v_t * v_t * kappa - ca_n) * normal
+
+        # Going out through an end
+        ca_t = (ca * np.conj(tangent)).real
+        v_t = np.where(end * v_t > 0, 0, v_t)
+        reac -= np.where(end * ca_t > 0, ca_t, 0) * tangent
+        return q + origin, v_origin + v_t * tangent, reac
+
+    def update(self):
+        origin = 0 if self.anchor is None else self.anchor.p
+        v_origin = self.anchor.v if isinstance(self.anchor, MassPoint) else 0
+        p = np.array([pt.p for pt in self.points], dtype=complex)
+        v = np.array([pt.v for pt in self.points], dtype=complex)
+        ca = np.array([pt.ca for pt in self.points], dtype=complex)
+        m = np.array([pt.m for pt in self.points], dtype=float)
+        q, v, reac = self.solve(origin, p, v, ca, m, v_origin)
+        for pt, qi, vi, ri in zip(self.points, q, v, reac):
+            pt.p = qi
+            pt.v = vi
+            pt.ca += ri
+        if isinstance(self.anchor, MassPoint):
+            self.anchor.ca -= reac.sum()
+
+    def links(self):
+        return [] if self.anchor is None else [[self.anchor] + self.points]
+
+    def restrict(self, points: list[MassPoint]):
+        return CurveConstraint(self.curve, points) if self.anchor is None else None
+
+    def bind(self, state: "ArrayState"):
+        self.idx = state.indices(self.points)
+        self.anchor_idx = None if self.anchor is None else state.indices([self.anchor])
+
+    def update_state(self, state: "ArrayState"):
+        idx = self.idx
+        origin = v_origin = 0
+        if self.anchor_idx is not None:
+            origin = state.p[..., self.anchor_idx]
+            v_origin = state.v[..., self.anchor_idx] if isinstance(self.anchor, MassPoint) else 0
+        q, v, reac = self.solve(origin, state.p[..., idx], state.v[..., idx], state.ca[..., idx], state.m[..., idx],
+                                v_origin)
+        state.p[..., idx] = q
+        state.v[..., idx] = v
+        state.ca[..., idx] += reac
+        if isinstance(self.anchor, MassPoint):
+            state.ca[..., self.anchor_idx] -= reac.sum(axis=-1, keepdims=True)
+
+    def init_draw(self, drawables: list["Line2D"]):
+        import matplotlib.pyplot as plt
+
+        super().init_draw(drawables)
+        (self.d_line,) = plt.plot([], [], "-", color="gray", linewidth=1, zorder=1)
+        drawables.append(self.d_line)
+
+    def draw(self, frame_id: int):
+        path = self.curve.path() + (0 if self.anchor is None else self.anchor.p)
+        self.d_line.set_data(path.real, path.imag)
+        super().draw(frame_id)
+
+
+# Every CircleRestriction and CurveConstraint of a simulation computed with the array engine (their batch_class),
+# with the same results as one after the other. Each restriction gets the level after the last earlier one it
+# shares a MassPoint with (the points it moves and a MassPoint center or anchor), so that the restrictions of a
+# level are independent: the circles of a level are solved in one pass, its constraints in one pass per curve.
+# Without a batch, the levels of less than SCALAR_POINTS points (a chain of restrictions) run the update of each
+# restriction through the views of the points, cheaper than the arrays for so few points.
+class CurveRestrictionNetwork(CurveRestriction):
+    def __init__(self, restrictions: list[CurveRestriction]):
+        super().__init__([p for r in restrictions for p in r.points])
+        self.restrictions = restrictions
+
+    def bind(self, state: "ArrayState"):
+        last = np.full(len(state), -1, dtype=np.intp)
+        levels: list[list[CurveRestriction]] = []
+        for r in self.restrictions:
+            origin = r.center if isinstance(r, CircleRestriction) else r.anchor
+            touched = state.indices(r.points + ([origin] if isinstance(origin, MassPoint) else []))
+            level = int(last[touched].max(initial=-1)) + 1
+            last[touched] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(r)
+        scalar = state.batch_shape == ()
+        self.levels = [(level, None) if scalar and sum(len(r.points) for r in level) < SCALAR_POINTS else
+                       (level, self.bind_level(state, level)) for level in levels]
+
+    @staticmethod
+    def bind_level(state: "ArrayState", restrictions: list[CurveRestriction]) -> tuple:
+        circles = [r for r in restrictions if isinstance(r, CircleRestriction)]
+        counts = [len(r.points) for r in circles]
+        idx = state.indices(p for r in circles for p in r.points)
+        center_idx = np.repeat(state.indices(r.center for r in circles), counts)
+        radius = np.repeat(state.stack(r.radius for r in circles), counts, axis=-1)
+        movable_center = np.repeat([isinstance(r.center, MassPoint) for r in circles], counts).astype(bool)
+
+        # Constraints grouped by curve: their points, and the index of their anchor (-1 without one)
+        groups: dict[int, list[CurveConstraint]] = {}
+        for r in restrictions:
+            if isinstance(r, CurveConstraint):
+                groups.setdefault(id(r.curve), []).append(r)
+        constraints = []
+        for group in groups.values():
+            counts = [len(r.points) for r in group]
+            c_idx = state.indices(p for r in group for p in r.points)
+            anchor_idx = np.repeat([-1 if r.anchor is None else state.index_of(r.anchor) for r in group], counts)
+            movable_anchor = np.repeat([isinstance(r.anchor, MassPoint) for r in group], counts).astype(bool)
+            constraints.append((group[0], c_idx, anchor_idx.astype(np.intp), movable_anchor))
+        return idx, center_idx, radius, movable_center, constraints
+
+    def update_state(self, state: "ArrayState"):
+        for restrictions, arrays in self.levels:
+            if arrays is None:
+                for r in restrictions:
+                    r.update()
+                continue
+
+            idx, center_idx, radius, movable_center, constraints = arrays
+            if len(idx):
+                center = state.p[..., center_idx]
+                rel_p = center - state.p[..., idx]
+                rel_p_abs = np.abs(rel_p)
+                out = rel_p_abs >= radius
+                if out.any():
+                    reac = self.apply_reactions(state, idx, np.where(out, rel_p, 0), radius)
+                    state.p[..., idx] = np.where(out, center - radius * rel_p / np.where(out, rel_p_abs, 1),
+                                                 state.p[..., idx])
+                    scatter_add(state.ca, center_idx[movable_center], -reac[..., movable_center])
+
+            for constraint, c_idx, anchor_idx, movable_anchor in constraints:
+                origin = np.where(anchor_idx >= 0, state.p[..., anchor_idx], 0)
+                v_origin = np.where(movable_anchor, state.v[..., anchor_idx], 0)
+                q, v, reac = constraint.solve(origin, state.p[..., c_idx], state.v[..., c_idx], state.ca[..., c_idx],
+                                              state.m[..., c_idx], v_origin)
+                state.p[..., c_idx] = q
+                state.v[..., c_idx] = v
+                scatter_add(state.ca, c_idx, reac)
+                scatter_add(state.ca, anchor_idx[movable_anchor], -reac[..., movable_anchor])
+
+
+CircleRestriction.batch_class = CurveRestrictionNetwork
+CurveConstraint.batch_class = CurveRestrictionNetwork
@@ -0,0 +1,181 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+
+from config import BARNES_HUT_THETA, G_UNIVERSEL
+from .abstract import ForcePoint
+from points import MassPoint
+
+if TYPE_CHECKING:
+    from engine import ArrayState
+
+LEVELS = 16  # depth of the quadtree, cells of 1 / 2^16 of the bounding square
+EXACT_BELOW = 1000  # below this number of points the exact sum is cheaper than the tree
+BLOCK = 1024  # rows of the exact sum computed at once
+CHUNK = 4096  # bodies walking the tree at once
+
+
+def spread_bits(x: np.ndarray) -> np.ndarray:
+    x = x.astype(np.uint64)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x33333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x55555555)
+    return x
+
+
+def pairwise_sum(p: np.ndarray, w: np.ndarray, softening: float) -> np.ndarray:
+    # sum over j != i of w_j (p_j - p_i) / (|p_j - p_i|^2 + softening^2)^(3/2), by blocks of rows
+    out = np.empty(len(p), dtype=complex)
+    for start in range(0, len(p), BLOCK):
+        rows = np.arange(start, min(start + BLOCK, len(p)))
+        d = p[None, :] - p[rows, None]
+        r2 = d.real ** 2 + d.imag ** 2 + softening ** 2
+        # The point itself and the points at the same place (d = 0) exert no force
+        r2[np.arange(len(rows)), rows] = np.inf
+        r2[r2 == 0] = np.inf
+        out[rows] = (w * d / (r2 * np.sqrt(r2))).sum(axis=1)
+    return out
+
+
+class QuadTree:
+    # Every level of the tree is built at once from the Morton codes of the points: the points of a node are
+    # contiguous once sorted by code, the nodes of a level are the runs of equal codes >> 2 (LEVELS - level).
+    # Each node keeps its total weight, its center of weight and the range of its children in the next level.
+    def __init__(self, p: np.ndarray, w: np.ndarray) -> None:
+        self.p = p
+        self.w = w
+        low = complex(p.real.min(), p.imag.min())
+        side = max(np.ptp(p.real), np.ptp(p.imag)) or 1
+        q = (p - low) / side * (1 << LEVELS)
+        top = (1 << LEVELS) - 1
+        self.code = spread_bits(np.clip(q.real, 0, top)) | (spread_bits(np.clip(q.imag, 0, top)) << np.uint64(1))
+
+        order = np.argsort(self.code, kind="stable")
+        code = self.code[order]
+        weights = w[order]
+        moments = (w * p)[order]
+
+        keys, levels, starts, counts, mass, com = [], [], [], [], [], []
+        offsets = [0]
+        for level in range(LEVELS + 1):
+            k = code >> np.uint64(2 * (LEVELS - level))
+            start = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+            m = np.add.reduceat(weights, start)
+            keys.append(k[start])
+            levels.append(np.full(len(start), level))
+            starts.append(start)
+            counts.append(np.diff(np.r_[start, len(code)]))
+            mass.append(m)
+            com.append(np.add.reduceat(moments, start) / np.where(m == 0, 1, m))
+            offsets.append(offsets[-1] + len(start))
+
+        # Children of the nodes of a level: the nodes of the next level starting inside them
+        first, number = [], []
+        for level in range(LEVELS):
+            child = np.searchsorted(starts[level + 1], np.r_[starts[level], len(code)])
+            first.append(offsets[level + 1] + child[:-1])
+            number.append(np.diff(child))
+        first.append(np.zeros(len(starts[LEVELS]), dtype=np.intp))
+        number.append(np.zeros(len(starts[LEVELS]), dtype=np.intp))
+
+        self.key = np.concatenate(keys)
+        self.shift = (2 * (LEVELS - np.concatenate(levels))).astype(np.uint64)
+        self.deepest = np.concatenate(levels) == LEVELS
+        self.count = np.concatenate(counts)
+        self.mass = np.concatenate(mass)
+        self.com = np.concatenate(com)
+        self.size = side / 2.0 ** np.concatenate(levels)
+        self.first = np.concatenate(first)
+        self.number = np.concatenate(number)
+
+    def sum(self, theta: float, softening: float) -> np.ndarray:
+        # Same sum as pairwise_sum, a node seen under an angle smaller than theta counting as one point
+        out = np.zeros(len(self.p), dtype=complex)
+        for start in range(0, len(self.p), CHUNK):
+            body = np.arange(start, min(start + CHUNK, len(self.p)))
+            node = np.zeros(len(body), dtype=np.intp)
+            while len(body):
+                d = self.com[node] - self.p[body]
+                r2 = d.real ** 2 + d.imag ** 2
+                inside = (self.code[body] >> self.shift[node]) == self.key[node]
+                leaf = self.count[node] == 1
+                accept = ~inside & (leaf | (self.size[node] ** 2 < theta ** 2 * r2))
+                # Points sharing the cell of the body at the deepest level: their center without the body
+                merged = inside & ~leaf & self.deepest[node]
+
+                m = np.where(accept, self.mass[node], 0)
+                if merged.any():
+                    b, n = body[merged], node[merged]
+                    m_others = self.mass[n] - self.w[b]
+                    c = (self.mass[n] * self.com[n] - self.w[b] * self.p[b]) / np.where(m_others == 0, 1, m_others)
+                    d[merged] = c - self.p[b]
+                    r2[merged] = d[merged].real ** 2 + d[merged].imag ** 2
+                    m[merged] = m_others
+                done = accept | merged
+                r2 = r2[done] + softening ** 2
+                f = m[done] * d[done] / np.where(r2 == 0, np.inf, r2 * np.sqrt(r2))
+                out += np.bincount(body[done], f.real, len(out)) + 1j * np.bincount(body[done], f.imag, len(out))
+
+                # The other nodes are replaced by their children, the body itself (leaf containing it) is dropped
+                split = ~done & ~(inside & leaf)
+                number = self.number[node[split]]
+                body = np.repeat(body[split], number)
+                offset = np.arange(len(body)) - np.repeat(np.cumsum(number) - number, number)
+                node = np.repeat(self.first[node[split]], number) + offset
+        return out
+
+
+# Mutual attraction g w_i w_j / r^2 between every pair of points of the group, the weights being the masses (or
+# the given charges, with g < 0 for a coulomb like repulsion between charges of the same sign). softening
+# removes the singularity at r = 0, points at the very same place do not attract each other. Above exact_below
+# points, the sum is approximated with a Barnes-Hut quadtree of opening angle theta (theta = 0: always exact),
+# which needs weights of a single sign.
+class Gravitation(ForcePoint):
+    saved = ("g", "softening", "theta", "charges")
+    parameters = ("points", "exact_below")
+
+    def __init__(self, p: list[MassPoint], g: float = G_UNIVERSEL, softening: float = 0,
+                 theta: float = BARNES_HUT_THETA, exact_below: int = EXACT_BELOW,
+                 charges: Optional[list[float]] = None, *args, **kwargs):
+        super().__init__(p, *args, **kwargs)
+        self.g = g
+        self.softening = softening
+        self.theta = theta
+        self.exact_below = exact_below
+        self.charges = None if charges is None else np.asarray(charges, dtype=float)
+        self.index = {id(pt): i for i, pt in enumerate(p)}
+        self.forces = np.zeros(len(p), dtype=complex)
+
+    def compute(self, p: np.ndarray, w: np.ndarray) -> np.ndarray:
+        if self.theta == 0 or len(p) < self.exact_below:
+            return self.g * w * pairwise_sum(p, w, self.softening)
+        if (w < 0).any() and (w > 0).any():
+            raise ValueError("the Barnes-Hut approximation needs weights of a single sign, use theta=0")
+        return self.g * w * QuadTree(p, w).sum(self.theta, self.softening)
+
+    def get_force(self, p: MassPoint):
+        return self.forces[..., self.index[id(p)]]
+
+    def update(self):
+        p = np.array([pt.p for pt in self.points], dtype=complex)
+        w = self.charges if self.charges is not None else np.array([pt.m for pt in self.points], dtype=float)
+        self.forces = self.compute(p, w)
+        for pt, f in zip(self.points, self.forces):
+            pt.ca += f
+
+    def bind(self, state: "ArrayState"):
+        self.idx = state.indices(self.points)
+
+    def update_state(self, state: "ArrayState"):
+        p = state.p[..., self.idx]
+        w = np.broadcast_to(self.charges if self.charges is not None else state.m[..., self.idx], p.shape)
+        if not state.batch_shape:
+            self.forces = self.compute(p, w)
+        else:
+            self.forces = np.zeros_like(p)
+            for member in np.ndindex(*state.batch_shape):
+                self.forces[member] = self.compute(p[member], w[member])
+        state.ca[..., self.idx] += self.forces
@@ -0,0 +1,185 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Runs a scene without any drawing (matplotlib is never imported) as fast as possible and saves the result.
+#
+#   python headless.py system --steps 100000 -o out.npz
+#   python headless.py scenes/pendulum.py --duration 60 --record-every 50 -o out.npz
+#   python headless.py cloth.npz --steps 1000 -o out.npz
+#   python headless.py cloth.npz --steps 1000 --checkpoint run.npz --checkpoint-every 100
+#   python headless.py cloth.npz --steps 1000 --restore run.npz -o out.npz
+#   python headless.py system --steps 100000 --cache .cache -o out.npz
+
+import argparse
+import importlib
+import importlib.util
+import os
+from typing import Optional
+
+import numpy as np
+
+from cache import ResultCache, scene_key
+from checkpoint import Checkpointer, restore, snapshot
+from config import CACHE_DIR, CACHE_SIZE
+from integrators import INTEGRATORS
+from profiler import Profiler
+from recorder import Recorder
+from scenefile import is_scene_file, load
+from simulator import Simulation
+
+
+def load_scene(scene: str) -> Simulation:
+    if is_scene_file(scene):
+        return load(scene)
+    if scene.endswith(".py") or os.sep in scene:
+        name = os.path.splitext(os.path.basename(scene))[0]
+        spec = importlib.util.spec_from_file_location(name, scene)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(scene)
+
+    sim = getattr(module, "sys", None)
+    if not isinstance(sim, Simulation):
+        sim = Simulation.sim
+    if sim is None:
+        raise ValueError(f"{scene} does not define a Simulation")
+    return sim
+
+
+def positions(sim: Simulation) -> np.ndarray:
+    if sim.state is not None:
+        return sim.state.p.copy()
+    return np.array([p.p for p in sim.points + sim.updatable_points], dtype=complex)
+
+
+def velocities(sim: Simulation) -> np.ndarray:
+    if sim.state is not None:
+        return sim.state.v.copy()
+    return np.array([getattr(p, "v", 0) for p in sim.points + sim.updatable_points], dtype=complex)
+
+
+def run(
+        sim: Simulation,
+        steps: Optional[int] = None,
+        duration: Optional[float] = None,
+        record_every: int = 0,
+        cache: Optional[ResultCache] = None,
+) -> dict[str, np.ndarray]:
+    # In adaptive mode, the step size is chosen by the simulation, and worker processes compute whole frames: a
+    # step is then a whole frame.
+    frames = sim.adaptive or bool(sim.workers)
+    advance = sim.update if frames else sim.step
+    if steps is None:
+        if duration is None:
+            raise ValueError("steps or duration must be given")
+        steps = round(duration / (sim.interval / 1000 if frames else sim.dt))
+
+    # A cached run of these steps is replayed, a shorter one is continued (not by worker processes, which cannot
+    # be restored from a checkpoint)
+    key = start = None
+    t = []
+    p = []
+    v = []
+    if cache is not None:
+        key = scene_key(sim)
+        found = cache.lookup(key, record_every, steps, prefix=sim.parallel is None)
+        if found is not None:
+            start, (result, last) = found[0], cache.split(found[1])
+            if start == steps:
+                if last and sim.parallel is None:
+                    restore(sim, last)
+                return result
+            restore(sim, last)
+            t, p, v = list(result["t"][:-1]), list(result["p"][:-1]), list(result["v"][:-1])
+
+    for i in range(start or 0, steps):
+        if record_every and i % record_every == 0:
+            t.append(sim.t)
+            p.append(positions(sim))
+            v.append(velocities(sim))
+        advance()
+
+    t.append(sim.t)
+    p.append(positions(sim))
+    v.append(velocities(sim))
+    result = {"t": np.array(t), "p": np.array(p), "v": np.array(v)}
+    if cache is not None:
+        cache.store(key, record_every, steps, result, snapshot(sim) if sim.parallel is None else {})
+    return result
+
+
+def save(path: str, result: dict[str, np.ndarray]) -> None:
+    np.savez(path, **result)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a scene without drawing it.")
+    parser.add_argument("scene", help="scene file (.json, .toml, .npz, see scenefile.py), module name (e.g. system) "
+                                      "or path of a python file defining the simulation")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--steps", type=int, help="number of substeps (frames in adaptive or parallel mode) to "
+                                                 "compute")
+    group.add_argument("--duration", type=float, help="simulated time to compute (s)")
+    parser.add_argument("--record-every", type=int, default=0, help="record the state every N steps")
+    parser.add_argument("--vectorized", action="store_true", help="use the array engine")
+    parser.add_argument("--integrator", choices=INTEGRATORS, help="integration scheme (implies --vectorized)")
+    parser.add_argument("--batch", type=int, help="simulate N copies of the scene at once (implies --vectorized)")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the step size to the estimated error")
+    parser.add_argument("--sleeping", action="store_true", help="put the islands at rest to sleep")
+    parser.add_argument("--workers", type=int, help="compute the islands in N worker processes (implies "
+                                                    "--vectorized, a step is then a frame)")
+    parser.add_argument("--trajectory", help="also record every step (or every --record-every steps) of the "
+                                             "movable points into this memory-mapped file")
+    parser.add_argument("--checkpoint", metavar="PATH", help="save the whole state in PATH (may contain {step}) "
+                                                             "every --checkpoint-every steps")
+    parser.add_argument("--checkpoint-every", type=int, default=1000)
+    parser.add_argument("--restore", metavar="PATH", help="start from a checkpoint of the same scene")
+    parser.add_argument("--cache", metavar="DIR", default=CACHE_DIR, help="replay the result of an identical run "
+                                                                          "kept in DIR, or continue a shorter one")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="size limit of the cache (bytes)")
+    parser.add_argument("--profile", metavar="PATH", help="time each phase and force, print the report and save "
+                                                          "it as json in PATH")
+    parser.add_argument("-o", "--output", default="out.npz")
+    args = parser.parse_args(argv)
+
+    sim = load_scene(args.scene)
+    if args.integrator is not None:
+        sim.integrator = INTEGRATORS[args.integrator]()
+    sim.adaptive = sim.adaptive or args.adaptive
+    sim.sleeping = sim.sleeping or args.sleeping
+    sim.workers = args.workers or sim.workers
+    if args.batch is not None:
+        if sim.state is not None and sim.batch != args.batch:
+            raise ValueError(f"{args.scene} is already vectorized, set the batch size in the scene")
+        sim.batch = args.batch
+    if args.vectorized or args.adaptive or args.batch is not None or args.integrator is not None or args.workers:
+        sim.vectorize()
+    if args.trajectory is not None:
+        sim.recorders.append(Recorder(args.trajectory, sim.updatable_points, args.record_every or 1,
+                                      batch_shape=sim.state.batch_shape if sim.state is not None else ()))
+    if args.profile is not None:
+        sim.profiler = Profiler()
+    sim.init()
+    if args.restore is not None:
+        restore(sim, args.restore)
+    if args.checkpoint is not None:
+        if sim.parallel is not None:
+            raise ValueError("no checkpoint with --workers")
+        sim.checkpointer = Checkpointer(args.checkpoint, args.checkpoint_every)
+    cache = None
+    if args.cache is not None:
+        if sim.recorders or sim.profiler is not None or sim.checkpointer is not None:
+            raise ValueError("--cache cannot be used with --trajectory, --profile or --checkpoint")
+        cache = ResultCache(args.cache, args.cache_size)
+    save(args.output, run(sim, args.steps, args.duration, args.record_every, cache))
+    sim.close()
+    for r in sim.recorders:
+        r.close()
+    if sim.profiler is not None:
+        print(sim.profiler.report())
+        sim.profiler.dump(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+
+from forces.basic import RessortNetwork
+from points import MassPoint
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+
+# Every integrator advances the array state of the simulation by dt, calling Simulation.compute_forces as many
+# times as its scheme needs. After a step, state.a holds the forces computed at the beginning of the step.
+class Integrator:
+    name = ""
+    order = 1
+
+    def reset(self) -> None:
+        pass
+
+    def save(self) -> dict[str, np.ndarray]:
+        # What the next steps depend on besides the state (checkpoint.py)
+        return {}
+
+    def load(self, sim: "Simulation", values: dict[str, np.ndarray]) -> None:
+        self.reset()
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        raise NotImplementedError
+
+
+class Euler(Integrator):
+    name = "euler"
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        state = sim.state
+        sim.compute_forces()
+        state.p += state.v * dt
+        state.v += state.ca * (state.inv_m * dt)
+        np.copyto(state.a, state.ca)
+
+
+class SemiImplicitEuler(Integrator):
+    name = "semi-implicit"
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        state = sim.state
+        sim.compute_forces()
+        state.v += state.ca * (state.inv_m * dt)
+        state.p += state.v * dt
+        np.copyto(state.a, state.ca)
+
+
+class VelocityVerlet(Integrator):
+    name = "verlet"
+    order = 2
+
+    def __init__(self):
+        self.acc: Optional[np.ndarray] = None
+
+    def reset(self) -> None:
+        self.acc = None
+
+    def save(self) -> dict[str, np.ndarray]:
+        return {} if self.acc is None else {"acc": self.acc.copy()}
+
+    def load(self, sim: "Simulation", values: dict[str, np.ndarray]) -> None:
+        self.acc = values["acc"].copy() if "acc" in values else None
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        state = sim.state
+        if self.acc is None or self.acc.shape != state.p.shape:
+            sim.compute_forces()
+            self.acc = state.ca * state.inv_m
+
+        state.v += 0.5 * dt * self.acc
+        state.p += state.v * dt
+        sim.compute_forces()
+        np.multiply(state.ca, state.inv_m, out=self.acc)
+        state.v += 0.5 * dt * self.acc
+        np.copyto(state.a, state.ca)
+
+
+class RK4(Integrator):
+    name = "rk4"
+    order = 4
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        state = sim.state
+        sim.compute_forces()
+        np.copyto(state.a, state.ca)
+        p0 = state.p.copy()
+        v0 = state.v.copy()
+
+        dp = v0.copy()
+        dv = state.ca * state.inv_m
+        for h, w in ((dt / 2, 2), (dt / 2, 2), (dt, 1)):
+            k_v = state.ca * state.inv_m
+            np.copyto(state.p, p0 + h * state.v)
+            np.copyto(state.v, v0 + h * k_v)
+            dp += w * state.v
+            sim.compute_forces()
+            dv += w * state.ca * state.inv_m
+
+        np.copyto(state.p, p0 + dt / 6 * dp)
+        np.copyto(state.v, v0 + dt / 6 * dv)
+
+
+class ImplicitEuler(Integrator):
+    # Linearised backward Euler on the springs: (M + h^2 L) dv = h f - h^2 L v, where L is the assembled spring
+    # stiffness. The other forces stay explicit. The sparsity pattern is built once per topology, each step only
+    # refills the values, and the conjugate gradient starts from the previous solution.
+    name = "implicit"
+
+    def __init__(self, rtol: float = 1e-8):
+        self.rtol = rtol
+        self.networks: tuple = ()
+        self.dv: Optional[np.ndarray] = None
+
+    def reset(self) -> None:
+        self.networks = ()
+        self.dv = None
+
+    def save(self) -> dict[str, np.ndarray]:
+        # The previous solution is the starting point of the conjugate gradient
+        return {} if self.dv is None else {"dv": self.dv.copy()}
+
+    def load(self, sim: "Simulation", values: dict[str, np.ndarray]) -> None:
+        self.reset()
+        if "dv" in values:
+            self.build(sim)
+            self.dv = values["dv"].copy()
+
+    def build(self, sim: "Simulation") -> None:
+        state = sim.state
+        if state.batch_shape:
+            raise ValueError("the implicit integrator does not support batched simulations")
+        self.networks = tuple(f for f in sim.state_forces if isinstance(f, RessortNetwork))
+        self.free = np.flatnonzero(state.inv_m > 0)
+        n = 2 * len(self.free)
+        free_id = np.full(len(state), -1)
+        free_id[self.free] = np.arange(len(self.free))
+
+        # Every coefficient of the matrix is an entry of the mass diagonal or of one spring block.
+        rows = [np.arange(n)]
+        cols = [np.arange(n)]
+        blocks = []
+        for net in self.networks:
+            fa = free_id[net.ia]
+            fb = free_id[net.ib]
+            both = (fa >= 0) & (fb >= 0)
+            for mask, ra, rb, sign in ((fa >= 0, fa, fa, 1), (fb >= 0, fb, fb, 1), (both, fa, fb, -1),
+                                       (both, fb, fa, -1)):
+                edges = np.flatnonzero(mask)
+                for c, (i, j) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+                    rows.append(2 * ra[edges] + i)
+                    cols.append(2 * rb[edges] + j)
+                    blocks.append((net, edges, c, sign))
+
+        keys = np.concatenate(rows) * n + np.concatenate(cols)
+        unique, self.inverse = np.unique(keys, return_inverse=True)
+        self.indices = unique % n
+        self.indptr = np.searchsorted(unique // n, np.arange(n + 1))
+        self.blocks = blocks
+        self.mass = np.repeat(state.m[self.free], 2)
+        self.dv = np.zeros(n)
+
+    def step(self, sim: "Simulation", dt: float) -> None:
+        from scipy.sparse import csr_matrix, diags
+        from scipy.sparse.linalg import cg
+
+        state = sim.state
+        networks = tuple(f for f in sim.state_forces if isinstance(f, RessortNetwork))
+        if networks != self.networks or self.dv is None:
+            self.build(sim)
+
+        sim.compute_forces()
+        np.copyto(state.a, state.ca)
+
+        n = len(self.mass)
+        if n == 0:
+            state.p += state.v * dt
+            return
+        stiffness = {id(net): net.stiffness(state) * (dt * dt) for net in self.networks}
+        values = [self.mass] + [sign * stiffness[id(net)][edges, c] for net, edges, c, sign in self.blocks]
+        data = np.bincount(self.inverse, np.concatenate(values), len(self.indices))
+        a = csr_matrix((data, self.indices, self.indptr), shape=(n, n))
+
+        v = state.v[self.free].view(float)
+        f = state.ca[self.free].view(float)
+        rhs = dt * f + self.mass * v - a @ v
+        self.dv, _ = cg(a, rhs, x0=self.dv, rtol=self.rtol, M=diags(1 / a.diagonal()))
+
+        state.v[self.free] += self.dv.view(complex)
+        if isinstance(sim.selected, MassPoint):
+            sim.selected.v = 0
+        state.p += state.v * dt
+
+
+INTEGRATORS: dict[str, type[Integrator]] = {
+    i.name: i for i in (Euler, SemiImplicitEuler, VelocityVerlet, RK4, ImplicitEuler)
+}
@@ -0,0 +1,145 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Splits a simulation into islands: sets of movable points coupled by forces (Force.links), fixed points do not
+# join islands. An island whose kinetic energy per point stays under SLEEP_ENERGY for SLEEP_FRAMES frames goes to
+# sleep: its points stop, and the forces that only act on sleeping points are not computed any more. It wakes up
+# when one of its points is selected or touched (Force.touching) by a moving island.
+# Islands with a kinematic point (moved by the simulation itself, as SinusoidalPoint) never sleep.
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from config import SLEEP_ENERGY, SLEEP_FRAMES
+from forces.abstract import Force
+from points import MassPoint, Point
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+
+def union_find(n: int, edges: list[tuple[int, int]]) -> np.ndarray:
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in edges:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(n)], dtype=np.intp)
+
+
+class Islands:
+    def __init__(self, sim: "Simulation", energy: float = SLEEP_ENERGY, frames: int = SLEEP_FRAMES) -> None:
+        self.energy = energy
+        self.frames = frames
+        self.points: list[Point] = sim.points + sim.updatable_points
+        self.index = index = {id(p): i for i, p in enumerate(self.points)}
+        movable = np.array([p.movable for p in self.points], dtype=bool)
+
+        edges = []
+        # Forces acting on each fixed point
+        anchors: dict[int, set[Force]] = {}
+        for f in sim.forces + sim.post_update_force:
+            for group in f.links():
+                ids = [index[id(p)] for p in group if p.movable]
+                edges.extend(zip(ids, ids[1:]))
+                if len(ids) < len(group):
+                    for p in group:
+                        if not p.movable:
+                            anchors.setdefault(index[id(p)], set()).add(f)
+        roots = np.where(movable, union_find(len(self.points), edges), -1)
+        _, self.label = np.unique(roots, return_inverse=True)
+        if not movable.all():
+            # Fixed points (root -1) are in no island
+            self.label -= 1
+        self.count = int(self.label.max(initial=-1)) + 1
+
+        self.mass = np.array([p.m if isinstance(p, MassPoint) else 0 for p in self.points], dtype=float)
+        self.mass_idx = np.flatnonzero((self.label >= 0) & (self.mass > 0))
+        self.sizes = np.bincount(self.label[self.mass_idx], minlength=self.count)
+        self.driven = np.zeros(self.count, dtype=bool)
+        for i, p in enumerate(self.points):
+            if p.movable and not isinstance(p, MassPoint):
+                self.driven[self.label[i]] = True
+
+        # Islands touched by each force, and global indices of the points of the forces reporting contacts
+        self.force_islands: dict[Force, np.ndarray] = {}
+        self.force_idx: dict[Force, np.ndarray] = {}
+        for f in sim.forces + sim.post_update_force:
+            ids = np.array([index[id(p)] for p in getattr(f, "points", [])], dtype=np.intp)
+            islands = np.unique(self.label[ids])
+            self.force_islands[f] = islands[islands >= 0]
+            if f.touching() is not None:
+                self.force_idx[f] = ids
+            for i in ids[self.label[ids] < 0].tolist():
+                anchors.setdefault(i, set()).add(f)
+        # Islands hanging from each fixed point: woken and held while it is dragged
+        self.anchored = {i: np.unique(np.concatenate([self.force_islands[f] for f in forces]))
+                         for i, forces in anchors.items()}
+
+        self.awake = np.ones(self.count, dtype=bool)
+        self.calm = np.zeros(self.count, dtype=int)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def active(self, force: Force) -> bool:
+        islands = self.force_islands[force]
+        return not len(islands) or bool(self.awake[islands].any())
+
+    def island_of(self, point: Point) -> int:
+        return int(self.label[self.index[id(point)]])
+
+    def islands_of(self, point: Point) -> np.ndarray:
+        # Island of a movable point, islands of the forces acting on a fixed one
+        i = self.index[id(point)]
+        if self.label[i] >= 0:
+            return self.label[i:i + 1]
+        return self.anchored.get(i, np.zeros(0, dtype=np.intp))
+
+    def sleeping_points(self) -> np.ndarray:
+        return np.flatnonzero((self.label >= 0) & ~self.awake[np.maximum(self.label, 0)])
+
+    def wake(self, islands: np.ndarray) -> bool:
+        islands = np.asarray(islands)
+        islands = islands[islands >= 0]
+        asleep = islands[~self.awake[islands]]
+        self.calm[islands] = 0
+        if not len(asleep):
+            return False
+        self.awake[asleep] = True
+        return True
+
+    def check(self, sim: "Simulation", v: np.ndarray) -> bool:
+        # Called once per frame with the velocities of every point, returns whether an island fell asleep or woke
+        # up. The energy is only computed for the points of the awake islands.
+        awake_idx = self.mass_idx[self.awake[self.label[self.mass_idx]]]
+        energy = np.bincount(self.label[awake_idx], 0.5 * self.mass[awake_idx] * np.abs(v[awake_idx]) ** 2,
+                             self.count)
+        moving = energy >= self.energy * np.maximum(self.sizes, 1)
+        self.calm = np.where(self.awake & ~moving, self.calm + 1, 0)
+
+        changed = False
+        for f, ids in self.force_idx.items():
+            i, j = f.touching()
+            li, lj = self.label[ids[i]], self.label[ids[j]]
+            both = (li >= 0) & (lj >= 0)
+            li, lj = li[both], lj[both]
+            # A moving island wakes up the sleeping islands it touches
+            changed |= self.wake(np.concatenate((lj[moving[li] & self.awake[li]], li[moving[lj] & self.awake[lj]])))
+
+        held = np.zeros(self.count, dtype=bool)
+        held[self.driven] = True
+        if sim.selected is not None:
+            held[self.islands_of(sim.selected)] = True
+        falling_asleep = self.awake & (self.calm >= self.frames) & ~held
+        if falling_asleep.any():
+            self.awake[falling_asleep] = False
+            changed = True
+        return changed
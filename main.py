@@ -14,14 +14,44 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 
-from config import INTERVAL
-from system import sys
+from config import DECOUPLED, INTERVAL, PROFILE, REALTIME_POLICY, WORKERS
+
+parser = argparse.ArgumentParser(description="Animate a scene.")
+parser.add_argument("scene", nargs="?", help="scene file (.json, .toml, .npz, see scenefile.py), module name or path "
+                                             "of a python file defining the simulation (default: system.py)")
+scene = parser.parse_args().scene
+if scene is None:
+    from system import sys
+else:
+    from headless import load_scene
+
+    sys = load_scene(scene)
 
 fig, ax = plt.subplots()
 
+if PROFILE is not None:
+    from profiler import Profiler
+
+    sys.profiler = Profiler()
+
+if WORKERS:
+    sys.workers = WORKERS
+
+worker = None
+if DECOUPLED:
+    from realtime import PhysicsWorker
+
+    # The physics runs in its own thread, the animation only draws its last snapshot
+    sys.batch_draw = True
+    sys.init()
+    worker = PhysicsWorker(sys, policy=REALTIME_POLICY)
+    info = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top", zorder=200)
+
 sys.init_draw()
 
 
@@ -30,11 +60,23 @@ def init():
     ax.set_xlim(-10, 10)
     ax.set_ylim(-10, 10)
 
+    if worker is not None:
+        if not worker.is_alive():
+            worker.start()
+        return update(None)
+
     sys.init()
     return sys.draw()
 
 
 def update(_):
+    if worker is not None:
+        with worker.snapshot() as snapshot:
+            sys.renderer.snapshot = snapshot
+            drawables = sys.draw()
+        info.set_text(f"t = {snapshot.t:.2f} s   sim/réel = {worker.ratio:.2f}")
+        return drawables + [info]
+
     sys.update()
     return sys.draw()
 
@@ -44,3 +86,8 @@ ani = FuncAnimation(
 )
 
 plt.show()
+sys.close()
+
+if sys.profiler is not None:
+    print(sys.profiler.report())
+    sys.profiler.dump(PROFILE)
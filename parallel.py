@@ -0,0 +1,185 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Advances the islands of a simulation (islands.py) in parallel worker processes. The islands are shared out
+# between the workers, each one builds a simulation of its own islands and, every frame, reads the state of its
+# points from shared memory, computes the frame and writes its movable points back. The state arrays of the main
+# simulation live in the same shared memory: the main process exchanges nothing but a short message per frame
+# and per worker, and draws the points as usual.
+# The workers are forked, so that they start with a copy of the simulation: this needs a system with fork.
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from forces.abstract import Force
+from islands import Islands, union_find
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+SHARED_FIELDS = ("p", "v", "a")
+
+
+def partition(sim: "Simulation", islands: Islands, workers: int) -> list[np.ndarray]:
+    # Islands joined by a force that cannot be split between workers (Force.restrict) stay together. The groups
+    # go to the least loaded worker, the most expensive first (cost: number of points and forces).
+    edges = []
+    for f in sim.forces + sim.post_update_force:
+        touched = islands.force_islands[f]
+        if len(touched) > 1 and f.restrict([]) is None:
+            edges.extend(zip(touched, touched[1:]))
+    group = union_find(len(islands), edges)
+
+    cost = np.bincount(islands.label[islands.label >= 0], minlength=len(islands)).astype(float)
+    for f in sim.forces + sim.post_update_force:
+        touched = islands.force_islands[f]
+        cost[touched] += 1 / max(len(touched), 1)
+    group_cost = np.bincount(group, cost, len(islands))
+
+    load = np.zeros(workers)
+    owner = np.zeros(len(islands), dtype=np.intp)
+    for g in np.argsort(-group_cost):
+        if group_cost[g] == 0:
+            break
+        w = int(np.argmin(load))
+        load[w] += group_cost[g]
+        owner[group == g] = w
+    return [np.flatnonzero(owner == w) for w in range(workers)]
+
+
+def worker_forces(sim: "Simulation", islands: Islands, mine: np.ndarray) -> list[Force]:
+    forces = []
+    for f in sim.forces + sim.post_update_force:
+        touched = islands.force_islands[f]
+        if not len(touched):
+            continue
+        inside = np.isin(touched, mine)
+        if inside.all():
+            forces.append(f)
+        elif inside.any():
+            forces.append(f.restrict([p for p in f.points if islands.island_of(p) in mine]))
+    return forces
+
+
+def run_worker(conn: Connection, sim: "Simulation", islands: Islands, mine: np.ndarray) -> None:
+    from simulator import Simulation
+
+    forces = worker_forces(sim, islands, mine)
+    points = set()
+    for f in forces:
+        for group in [getattr(f, "points", [])] + f.links():
+            points.update(id(p) for p in group)
+    points.update(id(islands.points[i]) for i in np.flatnonzero(np.isin(islands.label, mine)))
+    idx = np.array([i for i, p in enumerate(islands.points) if id(p) in points], dtype=np.intp)
+    local_points = [islands.points[i] for i in idx]
+    local = {int(i): pt for i, pt in zip(idx, local_points)}
+
+    shared = sim.state
+    sub = Simulation(local_points, forces, sim.pres, sim.interval, integrator=sim.integrator.name,
+                     adaptive=sim.adaptive, tolerance=sim.tolerance, sleeping=sim.sleeping, vectorized=True)
+    sub.init()
+    # Same order as local_points
+    state = sub.state
+    order = state.indices(local_points)
+    movable = np.isin(idx, np.flatnonzero(np.isin(islands.label, mine)))
+    owned, owned_local = idx[movable], order[movable]
+
+    while True:
+        message = conn.recv()
+        if message[0] == "stop":
+            break
+        if message[0] == "init":
+            sub.init()
+        else:
+            _, selected, sub.mouse_pos = message
+            for name in SHARED_FIELDS:
+                getattr(state, name)[order] = getattr(shared, name)[idx]
+            if local.get(selected) is not sub.selected:
+                sub.selected = local.get(selected)
+                if sub.selected is not None and sub.islands is not None:
+                    if sub.islands.wake(sub.islands.islands_of(sub.selected)):
+                        sub.refresh_active()
+            sub.update()
+            for name in SHARED_FIELDS:
+                getattr(shared, name)[owned] = getattr(state, name)[owned_local]
+        conn.send(sub.t)
+    conn.close()
+
+
+class ParallelRunner:
+    def __init__(self, sim: "Simulation", workers: int) -> None:
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("parallel islands need worker processes started with fork")
+        sim.vectorize()
+        state = sim.state
+        if state.batch_shape:
+            raise ValueError("a batched simulation cannot be split into islands")
+        self.sim = sim
+        self.islands = sim.islands if sim.islands is not None else Islands(sim)
+        self.index = self.islands.index
+
+        # The state arrays of the main simulation are moved to shared memory
+        self.memory: list[SharedMemory] = []
+        for name in SHARED_FIELDS:
+            values = getattr(state, name)
+            memory = SharedMemory(create=True, size=max(values.nbytes, 1))
+            array = np.ndarray(values.shape, values.dtype, memory.buf)
+            array[:] = values
+            setattr(state, name, array)
+            self.memory.append(memory)
+        state.show_member(0)
+
+        context = multiprocessing.get_context("fork")
+        self.connections: list[Connection] = []
+        self.processes = []
+        for mine in partition(sim, self.islands, workers):
+            if not len(mine):
+                continue
+            conn, child = context.Pipe()
+            process = context.Process(target=run_worker, args=(child, sim, self.islands, mine), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(conn)
+            self.processes.append(process)
+
+    def __len__(self) -> int:
+        return len(self.processes)
+
+    def gather(self) -> float:
+        return max((conn.recv() for conn in self.connections), default=self.sim.t)
+
+    def init(self) -> None:
+        for conn in self.connections:
+            conn.send(("init",))
+        self.gather()
+
+    def update(self) -> None:
+        sim = self.sim
+        selected = -1 if sim.selected is None else self.index[id(sim.selected)]
+        for conn in self.connections:
+            conn.send(("frame", selected, sim.mouse_pos))
+        # Without any worker (every point fixed), the time still goes on
+        sim.t = self.gather() if self.connections else sim.t + sim.interval / 1000
+        if sim.selected is not None and not sim.selected.movable:
+            # Fixed points are not written back by the workers
+            sim.selected.on_select_move(sim.mouse_pos)
+
+    def close(self) -> None:
+        for conn in self.connections:
+            conn.send(("stop",))
+        for process in self.processes:
+            process.join()
+        # Back to private arrays before freeing the shared memory
+        state = self.sim.state
+        for name in SHARED_FIELDS:
+            setattr(state, name, getattr(state, name).copy())
+        state.show_member(0)
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+        self.memory = []
+        self.connections = []
+        self.processes = []
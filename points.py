@@ -1,21 +1,33 @@
 # PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
 # License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
-from math import cos, sin
-from typing import Optional
+from typing import Callable, Optional, TYPE_CHECKING
 
-from matplotlib import pyplot as plt
-from matplotlib.artist import Artist
-from matplotlib.lines import Line2D
-from matplotlib.patches import FancyArrow
+from config import ARROW_SIZE, MAX_PAST_POINTS, PAST_POINT_FRAME, SCALE_VEC_A, SCALE_VEC_V
 
-from config import ARROW_SIZE, INTERVAL_S, MAX_PAST_POINTS, PAST_POINT_FRAME, SCALE_VEC_A, SCALE_VEC_V
+if TYPE_CHECKING:
+    import numpy as np
+    from matplotlib.artist import Artist
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import FancyArrow
+
+    from drivers import Driver
+    from engine import ArrayState
 
 
 class Point:
     movable = False
     selectable = True
-    d_points: Line2D
-    d_past_points: Line2D
+    d_points: "Line2D"
+    d_past_points: "Line2D"
+    state: Optional["ArrayState"] = None
+    state_id = -1
+    batch_drawn = False
+    past_pos_x: Optional[list[float]] = None
+    past_pos_y: Optional[list[float]] = None
+    # Attributes saved with the state of the simulation besides the position (checkpoint.py)
+    saved: tuple[str, ...] = ()
+    # Attributes fixed at construction that the motion depends on, besides the state (cache.py)
+    parameters: tuple[str, ...] = ("m",)
 
     def __init__(self, p: complex, m: float = 0, past_pos=True) -> None:
         self.p = p
@@ -24,7 +36,28 @@ class Point:
         self.past_pos_x = [] if past_pos and self.movable else None
         self.past_pos_y = [] if past_pos and self.movable else None
 
-    def init_draw(self, drawable: list[Artist], style="o", color: Optional[str] = "black"):
+    def bind(self, state: "ArrayState", i: int):
+        # Once bound, the point is an instance of its view class (view_class): its state is read from the slot i
+        if self.state is None:
+            self.__class__ = view_class(type(self))
+            for name in self.fields:
+                self.__dict__.pop(name, None)
+        self.state = state
+        self.state_id = i
+
+    def unbind(self):
+        if self.state is not None:
+            values = {name: getattr(self, name) for name in self.fields}
+            self.__class__ = self.base_class
+            self.state = None
+            self.state_id = -1
+            self.__dict__.update(values)
+
+    def init_draw(self, drawable: list["Artist"], style="o", color: Optional[str] = "black"):
+        from matplotlib import pyplot as plt
+
+        if self.batch_drawn:
+            return
         (self.d_points,) = plt.plot([self.p.real], [self.p.imag], style, color=color, zorder=100)
         drawable.append(self.d_points)
         if self.movable and self.past_pos_x is not None:
@@ -33,6 +66,8 @@ class Point:
             drawable.append(self.d_past_points)
 
     def draw(self, frame_id: int):
+        if self.batch_drawn:
+            return
         self.d_points.set_data([self.p.real], [self.p.imag])
 
         if self.past_pos_x is not None and frame_id % PAST_POINT_FRAME == 0:
@@ -61,31 +96,71 @@ class UpdatablePoint(Point):
         ...
 
 
-class SinusoidalPoint(UpdatablePoint):
-    movable = True
+class DrivenPoint(UpdatablePoint):
+    # Point following a prescribed motion of the time of the simulation, relative to center (moved with the mouse).
+    # The positions of all the points of a class are computed at once by its driver_class (drivers.py), at the end
+    # of each substep.
+    driver_class: Optional[type["Driver"]] = None
+    driver: Optional["Driver"] = None
+    driver_id = -1
+    saved = ("center",)
 
-    def __init__(self, center: complex, amp: complex, pulsation: float, cos_fact: complex = 1, sin_fact: complex = 1j):
-        super().__init__(center)
+    def __init__(self, center: complex, p0: complex):
+        super().__init__(p0)
         self.center = center
+
+    def update(self, _):
+        # Moved by its driver
+        ...
+
+    def on_select_move(self, c: complex):
+        self.center += c - self.p
+        if self.driver is not None:
+            self.driver.center[self.driver_id] = self.center
+        self.p = c
+
+
+class SinusoidalPoint(DrivenPoint):
+    parameters = ("amp", "pulsation", "cos_fact", "sin_fact")
+
+    def __init__(self, center: complex, amp: complex, pulsation: float, cos_fact: complex = 1, sin_fact: complex = 1j):
+        super().__init__(center, center + amp * cos_fact)
         self.amp = amp
         self.pulsation = pulsation
         self.cos_fact = cos_fact
         self.sin_fact = sin_fact
 
-    def update(self, _):
-        from simulator import Simulation
-        # print(Simulation.sin.)
-        self.p = self.center + self.amp * (
-                self.sin_fact * sin(self.pulsation * Simulation.sim.frame_id * INTERVAL_S) +
-                self.cos_fact * cos(self.pulsation * Simulation.sim.frame_id * INTERVAL_S))
 
-    def on_select_move(self, c: complex):
-        self.center = c
+class KeyframePoint(DrivenPoint):
+    # Linear interpolation between positions at increasing times, held at the ends or repeated with loop
+    parameters = ("times", "positions", "loop")
+
+    def __init__(self, times: list[float], positions: list[complex], loop: bool = False, center: complex = 0):
+        if len(times) != len(positions) or not len(times):
+            raise ValueError("a KeyframePoint needs as many times as positions, at least one")
+        if any(b < a for a, b in zip(times[:-1], times[1:])):
+            raise ValueError("the times of a KeyframePoint must be increasing")
+        super().__init__(center, center + positions[0])
+        self.times = times
+        self.positions = positions
+        self.loop = loop
+
+
+class PathPoint(KeyframePoint):
+    # t -> f(t) (complex, vectorised) tabulated once on [0, duration]
+    def __init__(self, f: Callable[["np.ndarray"], "np.ndarray"], duration: float, samples: int = 1000,
+                 loop: bool = True, center: complex = 0):
+        import numpy as np
+
+        t = np.linspace(0, duration, samples)
+        super().__init__(t, np.asarray(f(t), dtype=complex), loop, center)
 
 
 class MassPoint(UpdatablePoint):
-    d_v_arrow: FancyArrow
-    d_a_arrow: FancyArrow
+    d_v_arrow: "FancyArrow"
+    d_a_arrow: "FancyArrow"
+    show_v_vect = False
+    show_a_vect = False
 
     def __init__(self, p0: complex, v0: complex, m: float, show_v_vect=False, show_a_vect=False) -> None:
         super().__init__(p0, m)
@@ -100,7 +175,12 @@ class MassPoint(UpdatablePoint):
         self.show_a_vect = show_a_vect
 
     def init_draw(self, drawable, *args, **kwargs):
+        from matplotlib import pyplot as plt
+
         super().init_draw(drawable, *args, **kwargs, color=None)
+        if self.batch_drawn:
+            return
+
         if self.show_v_vect:
             v = self.v * SCALE_VEC_V
             self.d_v_arrow = plt.arrow(x=self.p.real, y=self.p.imag, dx=v.real, dy=v.imag, color="#fbbf24",
@@ -114,6 +194,9 @@ class MassPoint(UpdatablePoint):
             drawable.append(self.d_a_arrow)
 
     def draw(self, frame_id: int):
+        if self.batch_drawn:
+            return
+
         if self.show_v_vect:
             v = self.v * SCALE_VEC_V
             self.d_v_arrow.set_data(x=self.p.real, y=self.p.imag, dx=v.real, dy=v.imag)
@@ -137,3 +220,87 @@ class MassPoint(UpdatablePoint):
 
 def __repr__(self) -> str:
     return f"AP (p={self.p}, v={self.v}, m={self.m})"
+
+
+# Views of the points bound to an ArrayState: their position (and velocity, acceleration and forces for a
+# MassPoint) are properties over their slot. The points keep plain attributes until they are bound, the object
+# engine does not pay for the properties.
+class PointView:
+    fields = ("p",)
+    base_class: type[Point]
+    state: "ArrayState"
+
+    @property
+    def p(self) -> complex:
+        return complex(self.state.view_p[self.state_id])
+
+    @p.setter
+    def p(self, p: complex):
+        self.state.p[..., self.state_id] = p
+
+
+class MassPointView(PointView):
+    fields = ("p", "v", "a", "ca")
+
+    @property
+    def v(self) -> complex:
+        return complex(self.state.view_v[self.state_id])
+
+    @v.setter
+    def v(self, v: complex):
+        self.state.v[..., self.state_id] = v
+
+    @property
+    def a(self) -> complex:
+        return complex(self.state.view_a[self.state_id])
+
+    @a.setter
+    def a(self, a: complex):
+        self.state.a[..., self.state_id] = a
+
+    @property
+    def ca(self) -> complex:
+        return complex(self.state.view_ca[self.state_id])
+
+    @ca.setter
+    def ca(self, ca: complex):
+        self.state.ca[..., self.state_id] = ca
+
+
+VIEW_CLASSES: dict[type, type] = {}
+
+
+def view_class(cls: type[Point]) -> type[Point]:
+    # Subclass of cls with the properties of the view, under the same name
+    if cls not in VIEW_CLASSES:
+        view = MassPointView if issubclass(cls, MassPoint) else PointView
+        VIEW_CLASSES[cls] = type(cls.__name__, (view, cls), {"__qualname__": cls.__qualname__,
+                                                             "__module__": cls.__module__, "base_class": cls})
+    return VIEW_CLASSES[cls]
+
+
+def point_views(cls: type[Point], state: "ArrayState", idx: "np.ndarray") -> list[Point]:
+    # Points of class cls bound to the slots idx of the state without running their constructor, for the scenes
+    # loaded from arrays (scenefile.py): they keep no past positions and their initial position and velocity are
+    # the ones of the state.
+    view = view_class(cls)
+    new = view.__new__
+    points = [new(view) for _ in range(len(idx))]
+    if not issubclass(cls, MassPoint):
+        for pt, i in zip(points, idx.tolist()):
+            d = pt.__dict__
+            d["state"] = state
+            d["state_id"] = i
+            d["m"] = 0
+        return points
+
+    first = (0,) * len(state.batch_shape)
+    for pt, i, m, p0, v0 in zip(points, idx.tolist(), state.m[first][idx].tolist(), state.init_p[first][idx].tolist(),
+                                state.init_v[first][idx].tolist()):
+        d = pt.__dict__
+        d["state"] = state
+        d["state_id"] = i
+        d["m"] = m
+        d["init_p"] = p0
+        d["init_v"] = v0
+    return points
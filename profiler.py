@@ -0,0 +1,52 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Cumulative time and number of calls of each phase of a simulation (update, step, forces, points, draw...),
+# split by class for the forces and the points. The simulation only measures when it has a profiler
+# (Simulation.profiler), without one the cost is a test per force and per step.
+import json
+from collections import defaultdict
+from time import perf_counter
+
+PHASES = ("update", "step", "force", "point", "integrator", "record", "draw", "draw force",
+          "draw point", "draw batch")
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.times: defaultdict[tuple[str, str], float] = defaultdict(float)
+        self.calls: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.start = perf_counter()
+
+    def add(self, phase: str, name: str, elapsed: float) -> None:
+        key = (phase, name)
+        self.times[key] += elapsed
+        self.calls[key] += 1
+
+    def reset(self) -> None:
+        self.times.clear()
+        self.calls.clear()
+        self.start = perf_counter()
+
+    def results(self) -> list[dict]:
+        order = {phase: i for i, phase in enumerate(PHASES)}
+        keys = sorted(self.times, key=lambda k: (order.get(k[0], len(order)), -self.times[k]))
+        return [
+            {"phase": phase, "name": name, "calls": self.calls[phase, name], "time": self.times[phase, name]}
+            for phase, name in keys
+        ]
+
+    def report(self) -> str:
+        wall = perf_counter() - self.start
+        lines = [f"{'phase':<12}{'name':<24}{'calls':>10}{'total (s)':>12}{'mean (µs)':>12}{'% wall':>8}"]
+        for r in self.results():
+            lines.append(
+                f"{r['phase']:<12}{r['name']:<24}{r['calls']:>10}{r['time']:>12.4f}"
+                f"{1e6 * r['time'] / r['calls']:>12.2f}{100 * r['time'] / wall:>8.1f}"
+            )
+        lines.append(f"wall time: {wall:.4f} s")
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"wall": perf_counter() - self.start, "results": self.results()}, f, indent=1)
@@ -0,0 +1,106 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Runs the physics of a simulation in a background thread, paced on the wall clock, independently of the drawing.
+# After each physics frame the worker publishes a snapshot of the state: it writes the back buffer, then swaps it
+# with the front buffer read by the renderer. The swap is skipped (the physics never waits for the drawing) while
+# the renderer is reading the front buffer.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+from config import VITESSE_ANIM
+from simulator import Simulation
+
+CATCH_UP = "catch-up"
+DROP = "drop"
+
+
+class Snapshot:
+    def __init__(self, n: int) -> None:
+        self.t = 0.0
+        self.p = np.zeros(n, dtype=complex)
+        self.v = np.zeros(n, dtype=complex)
+        self.a = np.zeros(n, dtype=complex)
+
+    def copy_from(self, sim: Simulation) -> None:
+        state = sim.state
+        self.t = sim.t
+        np.copyto(self.p, state.view_p)
+        np.copyto(self.v, state.view_v)
+        np.copyto(self.a, state.view_a)
+
+
+class PhysicsWorker(threading.Thread):
+    # policy: when the physics is late by more than max_lag seconds of simulated time, CATCH_UP computes frames
+    # without pause until it is on time again, DROP gives up the late simulated time (the simulation slows down).
+    def __init__(self, sim: Simulation, speed: float = VITESSE_ANIM / 100, policy: str = CATCH_UP,
+                 max_lag: float = 0.25) -> None:
+        super().__init__(daemon=True)
+        if policy not in (CATCH_UP, DROP):
+            raise ValueError(f"unknown pacing policy {policy!r}")
+        sim.vectorize()
+        self.sim = sim
+        self.speed = speed
+        self.policy = policy
+        self.max_lag = max_lag
+
+        n = len(sim.state)
+        self.front = Snapshot(n)
+        self.back = Snapshot(n)
+        self.front.copy_from(sim)
+        self.lock = threading.Lock()
+        self.running = False
+
+        self.frames = 0
+        self.dropped = 0.0
+        self.history: deque[tuple[float, float]] = deque(maxlen=64)
+
+    @property
+    def ratio(self) -> float:
+        # Simulated time / real time over the last frames
+        if len(self.history) < 2:
+            return 0.0
+        (wall_0, t_0), (wall_1, t_1) = self.history[0], self.history[-1]
+        return (t_1 - t_0) / (wall_1 - wall_0) if wall_1 > wall_0 else 0.0
+
+    @contextmanager
+    def snapshot(self) -> Iterator[Snapshot]:
+        with self.lock:
+            yield self.front
+
+    def publish(self) -> None:
+        self.back.copy_from(self.sim)
+        if self.lock.acquire(blocking=False):
+            self.front, self.back = self.back, self.front
+            self.lock.release()
+
+    def run(self) -> None:
+        sim = self.sim
+        frame = sim.interval / 1000
+        self.running = True
+        start = time.perf_counter()
+        t_start = sim.t
+        while self.running:
+            now = time.perf_counter()
+            lag = t_start + self.speed * (now - start) - sim.t
+            if lag < frame:
+                time.sleep((frame - lag) / self.speed)
+                continue
+            if lag > self.max_lag and self.policy == DROP:
+                start += (lag - frame) / self.speed
+                self.dropped += lag - frame
+
+            sim.update()
+            self.frames += 1
+            self.history.append((time.perf_counter(), sim.t))
+            self.publish()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,115 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Records the trajectory of some points into a memory-mapped file: one fixed size record (t, p, v, a) per
+# recorded step. The file grows by chunks of records, so the RAM used stays constant whatever the length of the
+# run. The layout is described in a small json file next to it (<path>.json), load() reads it back without copy.
+import json
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+
+from points import MassPoint, Point
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+FIELDS = ("p", "v", "a")
+
+
+class Recorder:
+    def __init__(
+            self,
+            path: str,
+            points: list[Point],
+            every: int = 1,
+            fields: tuple[str, ...] = FIELDS,
+            chunk: int = 4096,
+            batch_shape: tuple[int, ...] = (),
+    ) -> None:
+        self.path = path
+        self.points = points
+        self.every = every
+        self.fields = fields
+        self.chunk = chunk
+        self.batch_shape = batch_shape
+
+        self.dtype = np.dtype([("t", float)] + [(f, complex, batch_shape + (len(points),)) for f in fields])
+        self.count = 0
+        self.capacity = 0
+        self.step_id = 0
+        self.data: Optional[np.memmap] = None
+        self.idx: Optional[np.ndarray] = None
+
+        open(path, "wb").close()
+        self.grow()
+
+    def grow(self) -> None:
+        if self.data is not None:
+            self.data.flush()
+            del self.data
+        self.capacity += self.chunk
+        with open(self.path, "r+b") as f:
+            f.truncate(self.capacity * self.dtype.itemsize)
+        self.data = np.memmap(self.path, self.dtype, "r+", shape=(self.capacity,))
+        self.write_header()
+
+    def write_header(self) -> None:
+        with open(self.path + ".json", "w") as f:
+            json.dump({"dtype": self.dtype.descr, "count": self.count, "every": self.every}, f)
+
+    def values(self, sim: "Simulation", field: str):
+        state = sim.state
+        if state is not None:
+            if self.idx is None:
+                self.idx = state.indices(self.points)
+            if field == "a":
+                # state.a holds the forces of the last step, inv_m changes with set_mass and the sleeping islands
+                return state.a[..., self.idx] * state.inv_m[..., self.idx]
+            return getattr(state, field)[..., self.idx]
+
+        if field == "p":
+            return [pt.p for pt in self.points]
+        if field == "v":
+            return [pt.v if isinstance(pt, MassPoint) else 0 for pt in self.points]
+        return [pt.a / pt.m if isinstance(pt, MassPoint) else 0 for pt in self.points]
+
+    def record(self, sim: "Simulation") -> None:
+        self.step_id += 1
+        if self.step_id % self.every:
+            return
+        if self.count == self.capacity:
+            self.grow()
+
+        record = self.data[self.count]
+        record["t"] = sim.t
+        for field in self.fields:
+            record[field] = self.values(sim, field)
+        self.count += 1
+
+    def reset(self) -> None:
+        self.count = 0
+        self.step_id = 0
+
+    def flush(self) -> None:
+        self.data.flush()
+        self.write_header()
+
+    def close(self) -> None:
+        self.data.flush()
+        del self.data
+        self.data = None
+        with open(self.path, "r+b") as f:
+            f.truncate(self.count * self.dtype.itemsize)
+        self.capacity = self.count
+        self.write_header()
+
+
+def load(path: str) -> np.ndarray:
+    with open(path + ".json") as f:
+        header = json.load(f)
+    dtype = np.dtype([tuple(d) if len(d) == 2 else (d[0], d[1], tuple(d[2])) for d in header["dtype"]])
+    if header["count"] == 0:
+        # Nothing recorded, the file is empty and cannot be mapped
+        return np.empty(0, dtype)
+    return np.memmap(path, dtype, "r", shape=(header["count"],))
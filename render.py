@@ -0,0 +1,175 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Draws every spring, point and trail of a simulation with a handful of artists updated from arrays, instead of
+# one artist (and one python loop) per object.
+from itertools import chain
+from typing import TYPE_CHECKING
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.collections import LineCollection
+
+from config import MAX_PAST_POINTS, PAST_POINT_FRAME, SCALE_K, SCALE_K_SIZE, SCALE_R_ZIG_ZAG, SCALE_VEC_A, \
+    SCALE_VEC_V
+from forces.basic import Ressort, RessortNetwork
+from points import MassPoint
+
+if TYPE_CHECKING:
+    from simulator import Simulation
+
+
+class BatchRenderer:
+    def __init__(self, sim: "Simulation") -> None:
+        self.sim = sim
+        self.all_points = sim.points + sim.updatable_points
+        index = {id(p): i for i, p in enumerate(self.all_points)}
+
+        self.ressorts = [f for f in sim.forces if isinstance(f, Ressort)]
+        ia = [np.array([index[id(r.pta)] for r in self.ressorts], dtype=np.intp)]
+        ib = [np.array([index[id(r.ptb)] for r in self.ressorts], dtype=np.intp)]
+        k = [np.array([r.k for r in self.ressorts], dtype=float)]
+        l0 = [np.array([r.l0 for r in self.ressorts], dtype=float)]
+        # Springs given as arrays (RessortNetwork.from_arrays)
+        for f in sim.forces:
+            if isinstance(f, RessortNetwork) and f.nodes is not None:
+                nodes = np.array([index[id(p)] for p in f.nodes], dtype=np.intp)
+                ia.append(nodes[f.a])
+                ib.append(nodes[f.b])
+                k.append(f.spring_k)
+                l0.append(f.spring_l0)
+        self.ia, self.ib, k, l0 = (np.concatenate(x) for x in (ia, ib, k, l0))
+
+        # Zig-zag template: vertex j of spring e is at pta + frac[e, j] (ptb - pta) + side[e, j] * width[e] * normal.
+        # Springs with less vertices are padded with ptb.
+        nb_points = (SCALE_K * l0 // k).astype(int) + 2
+        nb_max = nb_points.max(initial=2)
+        j = np.arange(nb_max + 1)
+        i = j[None, :] - 1
+        c = nb_points[:, None]
+        self.frac = np.where(j == 0, 0, np.where(i < c - 1, (i + 0.5) / c, 1))
+        self.side = np.where((j > 0) & (i < c - 1), np.where(i % 2 == 0, 1, -1), 0)
+        self.width = SCALE_K_SIZE * k + SCALE_R_ZIG_ZAG
+
+        self.fixed = np.array([i for i, p in enumerate(self.all_points) if not p.movable], dtype=np.intp)
+        self.movable = np.array([i for i, p in enumerate(self.all_points) if p.movable], dtype=np.intp)
+        self.trailed = np.array([i for i, p in enumerate(self.all_points) if p.past_pos_x is not None],
+                                dtype=np.intp)
+        self.trails = np.full((MAX_PAST_POINTS, len(self.trailed)), np.nan, dtype=complex)
+
+        for p in self.all_points:
+            p.batch_drawn = True
+        for r in self.ressorts:
+            r.batch_drawn = True
+
+        self.vectors = VectorOverlay(self)
+        # Snapshot published by a realtime.PhysicsWorker, drawn instead of the live state when set
+        self.snapshot = None
+
+    def positions(self) -> np.ndarray:
+        return self.values("p")
+
+    def values(self, name: str) -> np.ndarray:
+        if self.snapshot is not None:
+            return getattr(self.snapshot, name)
+        if self.sim.state is not None:
+            return getattr(self.sim.state, "view_" + name)
+        return np.array([getattr(p, name, 0) for p in self.all_points], dtype=complex)
+
+    def init_draw(self, drawables: list[Artist]) -> None:
+        ax = plt.gca()
+        colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        movable_colors = [
+            colors[k % len(colors)] if isinstance(self.all_points[i], MassPoint) else "black"
+            for k, i in enumerate(self.movable)
+        ]
+        color_of = dict(zip(self.movable, movable_colors))
+
+        self.d_springs = LineCollection([], colors=[colors[k % len(colors)] for k in range(len(self.ia))],
+                                        zorder=50)
+        ax.add_collection(self.d_springs)
+        (self.d_fixed,) = ax.plot([], [], "o", color="black", zorder=100)
+        p = self.positions()[self.movable]
+        trails = self.trails.ravel()
+        trail_colors = [color_of[i] for i in self.trailed] * MAX_PAST_POINTS
+        self.d_movable = ax.scatter(p.real, p.imag, c=movable_colors or None, zorder=100)
+        self.d_trails = ax.scatter(trails.real, trails.imag, marker="+", c=trail_colors or None, zorder=5)
+        drawables.extend((self.d_springs, self.d_fixed, self.d_movable, self.d_trails))
+        self.vectors.init_draw(drawables)
+
+    def reset(self) -> None:
+        self.trails.fill(np.nan)
+
+    def draw(self, frame_id: int) -> None:
+        p = self.positions()
+
+        pa = p[self.ia]
+        pb = p[self.ib]
+        d = pb - pa
+        d_abs = np.abs(d)
+        normal = 1j * d / np.where(d_abs == 0, 1, d_abs)
+        zig_zag = pa[:, None] + self.frac * d[:, None] + (self.side * self.width[:, None]) * normal[:, None]
+        self.d_springs.set_segments(np.stack((zig_zag.real, zig_zag.imag), axis=-1))
+
+        self.d_fixed.set_data(p[self.fixed].real, p[self.fixed].imag)
+        self.d_movable.set_offsets(np.column_stack((p[self.movable].real, p[self.movable].imag)))
+
+        if frame_id % PAST_POINT_FRAME == 0:
+            self.trails[frame_id // PAST_POINT_FRAME % MAX_PAST_POINTS] = p[self.trailed]
+            trails = self.trails.ravel()
+            self.d_trails.set_offsets(np.column_stack((trails.real, trails.imag)))
+
+        self.vectors.draw(p)
+
+
+# Velocity, acceleration and force arrows as three quivers. The forces are the ones applied during the last step
+# (Force.last_forces, kept by the simulation for the shown forces), they are not computed again.
+class VectorOverlay:
+    def __init__(self, renderer: BatchRenderer) -> None:
+        self.renderer = renderer
+        sim = renderer.sim
+        index = {id(p): i for i, p in enumerate(renderer.all_points)}
+        points = renderer.all_points
+
+        self.v_idx = np.array([i for i, p in enumerate(points) if isinstance(p, MassPoint) and p.show_v_vect],
+                              dtype=np.intp)
+        self.a_idx = np.array([i for i, p in enumerate(points) if isinstance(p, MassPoint) and p.show_a_vect],
+                              dtype=np.intp)
+
+        self.forces = [f for f in chain(sim.forces, sim.post_update_force) if f.show]
+        self.f_idx = np.array([index[id(p)] for f in self.forces for p in f.points], dtype=np.intp)
+        for f in self.forces:
+            f.batch_drawn = True
+            sim.captured_forces[f] = sim.state.indices(f.points) if sim.state is not None else None
+
+    def quiver(self, ax, idx: np.ndarray, color: str, zorder: int):
+        p = self.renderer.positions()[idx]
+        return ax.quiver(p.real, p.imag, np.zeros(len(idx)), np.zeros(len(idx)), color=color, zorder=zorder,
+                         angles="xy", scale_units="xy", scale=1, minlength=0, width=0.004)
+
+    def init_draw(self, drawables: list[Artist]) -> None:
+        ax = plt.gca()
+        self.d_v = self.quiver(ax, self.v_idx, "#fbbf24", 10)
+        self.d_a = self.quiver(ax, self.a_idx, "#f43f5e", 10)
+        self.d_f = self.quiver(ax, self.f_idx, "#10b981", 20)
+        drawables.extend((self.d_v, self.d_a, self.d_f))
+
+    def draw(self, p: np.ndarray) -> None:
+        if len(self.v_idx):
+            v = self.renderer.values("v")[self.v_idx] * SCALE_VEC_V
+            self.d_v.set_offsets(np.column_stack((p[self.v_idx].real, p[self.v_idx].imag)))
+            self.d_v.set_UVC(v.real, v.imag)
+
+        if len(self.a_idx):
+            a = self.renderer.values("a")[self.a_idx] * SCALE_VEC_A
+            self.d_a.set_offsets(np.column_stack((p[self.a_idx].real, p[self.a_idx].imag)))
+            self.d_a.set_UVC(a.real, a.imag)
+
+        if self.forces:
+            f = np.concatenate([
+                np.zeros(len(force.points)) if force.last_forces is None else force.last_forces
+                for force in self.forces
+            ])
+            self.d_f.set_offsets(np.column_stack((p[self.f_idx].real, p[self.f_idx].imag)))
+            self.d_f.set_UVC(f.real, f.imag)
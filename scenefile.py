@@ -0,0 +1,195 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Scenes described by data instead of python code, built by load(path) and written by save(path, ...).
+#
+# JSON or TOML, for small scenes: the arguments of the simulation, of each point and of each force, by name.
+#
+#   {
+#     "simulation": {"pres": 50, "integrator": "verlet"},
+#     "points": [
+#       {"type": "Point", "p": 0, "name": "A"},
+#       {"type": "MassPoint", "p0": "4+2j", "v0": 0, "m": 0.1, "name": "M"}
+#     ],
+#     "forces": [
+#       {"type": "Poids", "p": "*"},
+#       {"type": "Ressort", "pta": "A", "ptb": "M", "k": 5, "l0": 2},
+#       {"type": "CurveConstraint", "curve": {"type": "Circle", "radius": 4}, "p": ["M"]}
+#     ],
+#     "arrays": "cloth.npz"
+#   }
+#
+# Complex numbers are numbers or strings ("4+2j"). The points given to a force are indices or names, "*" being
+# every MassPoint.
+#
+# NPZ, for large scenes: the points and the springs as arrays. They are built without running the constructor of
+# any point (points.point_views) nor creating any Ressort (RessortNetwork.from_arrays).
+#   p, v: positions and initial velocities (complex), m: masses, 0 for a fixed point
+#   springs: indices of the two ends of each spring, shape (n, 2), k, l0: stiffness and rest length (per spring or
+#   scalars)
+#   scene: the description above (json text), optional
+# The points of the arrays come before the points of the description, the "arrays" entry of a JSON or TOML scene
+# being such a file (relative to the scene).
+import gc
+import json
+import os
+from typing import Any, Optional
+
+import numpy as np
+
+from engine import ArrayState
+from forces import FrottementsFluides, Poids, Ressort, RessortNetwork
+from forces.contact import Contact
+from forces.curve_restriction import Circle, CircleRestriction, CurveConstraint, Line, Polyline, Segment
+from forces.gravitation import Gravitation
+from points import KeyframePoint, MassPoint, Point, SinusoidalPoint, UpdatablePoint, point_views
+from simulator import Simulation
+
+POINT_TYPES = {cls.__name__: cls for cls in (Point, MassPoint, SinusoidalPoint, KeyframePoint)}
+FORCE_TYPES = {cls.__name__: cls for cls in (Poids, Ressort, FrottementsFluides, CircleRestriction, CurveConstraint,
+                                             Contact, Gravitation)}
+CURVE_TYPES = {cls.__name__: cls for cls in (Line, Circle, Polyline, Segment)}
+# Arguments of the forces that are points (or lists of points)
+POINT_ARGUMENTS = {"p", "pta", "ptb", "center", "anchor"}
+FORMATS = (".json", ".toml", ".npz")
+
+
+def is_scene_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in FORMATS
+
+
+def read(path: str) -> tuple[dict, dict[str, np.ndarray]]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        scene = json.loads(str(arrays.pop("scene"))) if "scene" in arrays else {}
+        return scene, arrays
+
+    if ext == ".json":
+        with open(path) as f:
+            scene = json.load(f)
+    elif ext == ".toml":
+        try:
+            import tomllib
+        except ImportError:  # python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            scene = tomllib.load(f)
+    else:
+        raise ValueError(f"unknown scene format: {path} (expected {', '.join(FORMATS)})")
+
+    arrays = {}
+    if "arrays" in scene:
+        _, arrays = read(os.path.join(os.path.dirname(path), scene["arrays"]))
+    return scene, arrays
+
+
+def value(x: Any) -> Any:
+    if isinstance(x, str):
+        try:
+            return complex(x.replace(" ", ""))
+        except ValueError:
+            return x
+    if isinstance(x, list):
+        return [value(y) for y in x]
+    if isinstance(x, dict) and "type" in x:
+        return create(CURVE_TYPES, x)
+    return x
+
+
+def create(types: dict[str, type], description: dict, resolve=None) -> Any:
+    kind = description.get("type")
+    if kind not in types:
+        raise ValueError(f"unknown type {kind!r}, expected one of {', '.join(types)}")
+    args = {
+        key: resolve(x) if resolve is not None and key in POINT_ARGUMENTS else value(x)
+        for key, x in description.items() if key not in ("type", "name")
+    }
+    return types[kind](**args)
+
+
+def array_points(arrays: dict[str, np.ndarray], described: list[Point],
+                 batch: Optional[int]) -> tuple[list[Point], ArrayState]:
+    # Points of the arrays followed by the described points, and their state in the order of the simulation (the
+    # fixed points first)
+    p = np.asarray(arrays["p"], dtype=complex)
+    v = np.asarray(arrays["v"], dtype=complex) if "v" in arrays else np.zeros(len(p), dtype=complex)
+    m = np.asarray(arrays["m"], dtype=float)
+    movable = np.concatenate((m > 0, [isinstance(pt, UpdatablePoint) for pt in described])).astype(bool)
+    all_p = np.concatenate((p, [pt.p for pt in described]))
+    all_v = np.concatenate((v, [pt.v if isinstance(pt, MassPoint) else 0 for pt in described]))
+    all_m = np.concatenate((m, [pt.m if isinstance(pt, MassPoint) else 0 for pt in described]))
+
+    order = np.concatenate((np.flatnonzero(~movable), np.flatnonzero(movable)))
+    slot = np.empty(len(order), dtype=np.intp)
+    slot[order] = np.arange(len(order))
+    state = ArrayState.from_arrays(all_p[order], all_v[order], all_m[order], batch)
+
+    points = np.empty(len(order), dtype=object)
+    fixed = np.flatnonzero(m <= 0)
+    masses = np.flatnonzero(m > 0)
+    points[fixed] = point_views(Point, state, slot[fixed])
+    points[masses] = point_views(MassPoint, state, slot[masses])
+    for i, pt in enumerate(described, len(p)):
+        points[i] = pt
+        pt.bind(state, int(slot[i]))
+    state.points = points[order].tolist()
+    return points.tolist(), state
+
+
+def build(scene: dict, arrays: Optional[dict[str, np.ndarray]] = None, **kwargs) -> Simulation:
+    arrays = arrays or {}
+    args = {**scene.get("simulation", {}), **kwargs}
+    # Creating millions of objects triggers as many garbage collections, none of them can free anything
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        points = [create(POINT_TYPES, d) for d in scene.get("points", [])]
+        names = {d["name"]: pt for d, pt in zip(scene.get("points", []), points) if "name" in d}
+        state = None
+        if "p" in arrays:
+            points, state = array_points(arrays, points, args.get("batch"))
+
+        def resolve(x):
+            if isinstance(x, list):
+                return [resolve(y) for y in x]
+            if x == "*":
+                return [pt for pt in points if isinstance(pt, MassPoint)]
+            if isinstance(x, str):
+                return names[x]
+            return None if x is None else points[x]
+
+        forces = [create(FORCE_TYPES, d, resolve) for d in scene.get("forces", [])]
+        if "springs" in arrays:
+            springs = np.asarray(arrays["springs"], dtype=np.intp).reshape(-1, 2)
+            forces.append(RessortNetwork.from_arrays(points, springs[:, 0], springs[:, 1], arrays["k"], arrays["l0"]))
+        return Simulation(points, forces, state=state, **args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load(path: str, **kwargs) -> Simulation:
+    # kwargs: arguments of the simulation, replacing the ones of the file
+    scene, arrays = read(path)
+    return build(scene, arrays, **kwargs)
+
+
+def save(path: str, scene: Optional[dict] = None, **arrays: np.ndarray) -> None:
+    # A JSON scene with arrays gets them in an NPZ file of the same name. Complex numbers are written as strings.
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        if scene is not None:
+            arrays["scene"] = np.array(json.dumps(scene, default=str))
+        np.savez(path, **arrays)
+    elif ext == ".json":
+        scene = dict(scene or {})
+        if arrays:
+            npz = os.path.splitext(path)[0] + ".npz"
+            np.savez(npz, **arrays)
+            scene["arrays"] = os.path.basename(npz)
+        with open(path, "w") as f:
+            json.dump(scene, f, indent=2, default=str)
+    else:
+        raise ValueError(f"cannot write {path} (expected .json or .npz)")
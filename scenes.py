@@ -0,0 +1,205 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Parameterised versions of the scenes of system.py, to build many simulations from code.
+from random import choices, randint, random
+from typing import Optional
+
+import numpy as np
+
+from forces import FrottementsFluides, Poids, Ressort
+from forces.abstract import Force
+from forces.contact import Contact
+from forces.curve_restriction import CircleRestriction
+from forces.gravitation import Gravitation
+from points import MassPoint, Point
+from simulator import Simulation
+
+
+def double_pendulum(k: float = 0.025, m1: float = 0.1, m2: float = 0.1, v2: complex = 0, **kwargs) -> Simulation:
+    a = Point(0)
+    m_1 = MassPoint(4 + 2j, 0j, m1)
+    m_2 = MassPoint(4, v2, m2)
+    return Simulation(
+        points=[a, m_1, m_2],
+        forces=[
+            Poids([m_1, m_2]),
+            CircleRestriction(m_1, [m_2], 4),
+            CircleRestriction(a, [m_1], 4),
+            FrottementsFluides(m_1, k),
+            FrottementsFluides(m_2, k),
+        ],
+        **kwargs,
+    )
+
+
+def randim_coord():
+    return random() * 10 - 5 + random() * 10j - 5j
+
+
+def random_network(nb_points: Optional[int] = None, nb_mov_points: Optional[int] = None, pres: int = 100,
+                   **kwargs) -> Simulation:
+    nb_points = randint(3, 10) if nb_points is None else nb_points
+    nb_mov_points = randint(3, 10) if nb_mov_points is None else nb_mov_points
+    points = [Point(randim_coord()) for _ in range(nb_points)]
+    mov_points = [
+        MassPoint(randim_coord(), randim_coord(), random() * 0.01 + 0.01)
+        for _ in range(nb_mov_points)
+    ]
+
+    forces: list[Force] = [
+        Poids(choices(mov_points, k=randint(3, nb_mov_points))),
+    ]
+
+    nb_tot = nb_points + nb_mov_points
+    n = randint(5, nb_tot * 2)
+
+    conns = set()
+    while len(conns) < n:
+        a = randint(0, nb_tot - 1)
+        b = randint(0, nb_tot - 1)
+        if a != b:
+            t = tuple(sorted([a, b]))
+            if t not in conns:
+                conns.add(t)
+
+    for p in choices(mov_points, k=randint(0, nb_mov_points)):
+        forces.append(FrottementsFluides(p, random() * 0.0000001))
+
+    for a, b in sorted(conns):
+        pta = points[a] if a < nb_points else mov_points[a - nb_points]
+        ptb = points[b] if b < nb_points else mov_points[b - nb_points]
+        forces.append(Ressort(pta, ptb, randint(1, 10), random() * 3 + 1))
+
+    return Simulation(points + mov_points, forces, pres, **kwargs)
+
+
+# Scenes of any size, for benchmark.py. The random ones take a seed so that every size is reproducible.
+def pendulum_chain(nb_points: int = 10, length: float = 8, k: float = 0.01, m: float = 0.1,
+                   **kwargs) -> Simulation:
+    link = length / nb_points
+    points = [Point(0)] + [MassPoint(link * (i + 1), 0j, m) for i in range(nb_points)]
+    forces: list[Force] = [Poids(points[1:])]
+    forces += [CircleRestriction(a, [b], link) for a, b in zip(points, points[1:])]
+    forces += [FrottementsFluides(p, k) for p in points[1:]]
+    return Simulation(points, forces, **kwargs)
+
+
+def spring_network(nb_points: int = 10, nb_springs: Optional[int] = None, fixed: float = 0.1, seed: int = 0,
+                   **kwargs) -> Simulation:
+    rng = np.random.default_rng(seed)
+    nb_springs = 2 * nb_points if nb_springs is None else nb_springs
+    nb_fixed = max(1, int(fixed * nb_points))
+    side = 5 * np.sqrt(nb_points / 10)
+    pos = (rng.random(nb_points) - 0.5) * side + 1j * (rng.random(nb_points) - 0.5) * side
+    points = [Point(complex(c)) for c in pos[:nb_fixed]]
+    masses = rng.random(nb_points - nb_fixed) * 0.01 + 0.01
+    points += [MassPoint(complex(c), 0j, float(m)) for c, m in zip(pos[nb_fixed:], masses)]
+
+    a = rng.integers(0, nb_points, nb_springs)
+    b = (a + rng.integers(1, nb_points, nb_springs)) % nb_points
+    forces: list[Force] = [Poids(points[nb_fixed:])]
+    forces += [
+        Ressort(points[i], points[j], int(k), float(l0))
+        for i, j, k, l0 in zip(a, b, rng.integers(1, 11, nb_springs), rng.random(nb_springs) * 3 + 1)
+    ]
+    return Simulation(points, forces, **kwargs)
+
+
+def cloth(nb_points: int = 100, width: float = 10, k: float = 50, m: float = 0.01, **kwargs) -> Simulation:
+    # Square grid hung by its two top corners
+    n = max(2, round(np.sqrt(nb_points)))
+    step = width / (n - 1)
+    grid = [[-width / 2 + step * x - 1j * step * y for x in range(n)] for y in range(n)]
+    nodes = [[Point(c) if y == 0 and x in (0, n - 1) else MassPoint(c, 0j, m) for x, c in enumerate(row)]
+             for y, row in enumerate(grid)]
+    masses = [p for row in nodes for p in row if isinstance(p, MassPoint)]
+    forces: list[Force] = [Poids(masses)]
+    for y in range(n):
+        for x in range(n):
+            if x + 1 < n:
+                forces.append(Ressort(nodes[y][x], nodes[y][x + 1], k, step))
+            if y + 1 < n:
+                forces.append(Ressort(nodes[y][x], nodes[y + 1][x], k, step))
+    forces += [FrottementsFluides(p, 0.01) for p in masses]
+    return Simulation([p for row in nodes for p in row], forces, **kwargs)
+
+
+def cloth_arrays(nb_points: int = 100, width: float = 10, k: float = 50, m: float = 0.01) -> dict[str, np.ndarray]:
+    # Same cloth as arrays for scenefile.save, e.g. save("cloth.npz", {"forces": [{"type": "Poids", "p": "*"}]},
+    # **cloth_arrays(500000))
+    n = max(2, round(np.sqrt(nb_points)))
+    step = width / (n - 1)
+    x, y = np.meshgrid(np.arange(n), np.arange(n))
+    p = (-width / 2 + step * x - 1j * step * y).ravel()
+    mass = np.full(n * n, m)
+    mass[[0, n - 1]] = 0
+    node = np.arange(n * n).reshape(n, n)
+    springs = np.concatenate((np.stack((node[:, :-1].ravel(), node[:, 1:].ravel()), axis=1),
+                              np.stack((node[:-1].ravel(), node[1:].ravel()), axis=1)))
+    return {"p": p, "m": mass, "springs": springs, "k": np.array(k), "l0": np.array(step)}
+
+
+def constrained_circles(nb_points: int = 10, per_circle: int = 10, radius: float = 1, seed: int = 0,
+                        **kwargs) -> Simulation:
+    # Groups of masses restricted to circles around fixed centers
+    rng = np.random.default_rng(seed)
+    nb_circles = max(1, nb_points // (per_circle + 1))
+    side = 3 * radius * np.sqrt(nb_circles)
+    pos = (rng.random(nb_circles) - 0.5) * side + 1j * (rng.random(nb_circles) - 0.5) * side
+    centers = [Point(complex(c)) for c in pos]
+    points: list[Point] = list(centers)
+    forces: list[Force] = []
+    for center in centers:
+        angles = rng.random(per_circle) * 2 * np.pi
+        masses = [MassPoint(center.p + radius * complex(np.exp(1j * t)), 0j, 0.1) for t in angles]
+        points += masses
+        forces += [Poids(masses), CircleRestriction(center, masses, radius)]
+    return Simulation(points, forces, **kwargs)
+
+
+def granular(nb_points: int = 100, radius: float = 0.2, k: float = 200, damping: float = 0.5, seed: int = 0,
+             **kwargs) -> Simulation:
+    # Grains poured in a V shaped hopper made of fixed points. Explicit Euler adds energy to every contact,
+    # the semi-implicit scheme is the default.
+    kwargs.setdefault("integrator", "semi-implicit")
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(nb_points)))
+    spacing = 2.5 * radius
+    width = 3 * columns * spacing
+    # Obstacles radius / 2 apart along the walls (45 degrees), close enough for the grains not to squeeze between
+    # them. The rims are above the poured grains, for none to splash out.
+    step = radius / 2 / np.sqrt(2)
+    wall = np.arange(-width, width + step, step)
+    obstacles = [Point(complex(x, abs(x) - width / 2)) for x in wall]
+    grains = [
+        MassPoint(complex(spacing * (i % columns - (columns - 1) / 2) + rng.random() * radius / 4,
+                          spacing * (i // columns) + radius), 0j, 0.01)
+        for i in range(nb_points)
+    ]
+    forces: list[Force] = [Poids(grains), Contact(obstacles + grains, radius, k, damping)]
+    return Simulation(obstacles + grains, forces, **kwargs)
+
+
+def cluster(nb_points: int = 100, g: float = 1, central_mass: float = 1000, seed: int = 0,
+            **kwargs) -> Simulation:
+    # Bodies on circular orbits around a heavy one, attracting each other
+    kwargs.setdefault("integrator", "verlet")
+    rng = np.random.default_rng(seed)
+    r = 2 + 8 * rng.random(nb_points - 1)
+    angle = 2 * np.pi * rng.random(nb_points - 1)
+    p = r * np.exp(1j * angle)
+    v = 1j * np.sqrt(g * central_mass / r) * np.exp(1j * angle)
+    bodies = [MassPoint(0j, 0j, central_mass)]
+    bodies += [MassPoint(complex(pi), complex(vi), 0.01) for pi, vi in zip(p, v)]
+    return Simulation(bodies, [Gravitation(bodies, g, softening=0.05)], **kwargs)
+
+
+BENCHMARK_SCENES = {
+    "pendulum_chain": pendulum_chain,
+    "spring_network": spring_network,
+    "cloth": cloth,
+    "constrained_circles": constrained_circles,
+    "granular": granular,
+    "cluster": cluster,
+}
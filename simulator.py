@@ -2,15 +2,29 @@
 # License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
 
 from itertools import chain
-from typing import Optional
+from time import perf_counter
+from typing import Iterable, Optional, TYPE_CHECKING
 
-from matplotlib import pyplot as plt
-from matplotlib.artist import Artist
-from matplotlib.backend_bases import MouseButton, MouseEvent
+import numpy as np
 
-from config import INTERVAL, SELECT_RADIUS, VITESSE_ANIM
+from config import ADAPTIVE_MAX_SHRINK, ADAPTIVE_TOL, INTERVAL, SELECT_RADIUS, VITESSE_ANIM
+from drivers import Driver
+from engine import ArrayState
 from forces.abstract import Force
-from points import MassPoint, Point, UpdatablePoint
+from integrators import Euler, INTEGRATORS, Integrator
+from islands import Islands
+from points import DrivenPoint, MassPoint, Point, UpdatablePoint
+from profiler import Profiler
+from recorder import Recorder
+from spatial import UniformGrid
+
+if TYPE_CHECKING:
+    from matplotlib.artist import Artist
+    from matplotlib.backend_bases import MouseEvent
+
+    from checkpoint import Checkpointer
+    from parallel import ParallelRunner
+    from render import BatchRenderer
 
 
 class Simulation:
@@ -22,9 +36,19 @@ class Simulation:
             forces: list[Force] = None,
             pres: int = 50,
             interval: int = INTERVAL * VITESSE_ANIM / 100,
+            vectorized: bool = False,
+            integrator: str = "euler",
+            adaptive: bool = False,
+            tolerance: float = ADAPTIVE_TOL,
+            batch: Optional[int] = None,
+            batch_draw: bool = False,
+            profiler: Optional[Profiler] = None,
+            sleeping: bool = False,
+            workers: Optional[int] = None,
+            state: Optional[ArrayState] = None,
     ) -> None:
         Simulation.sim = self
-        self.drawables: list[Artist] = []
+        self.drawables: list["Artist"] = []
 
         self.updatable_points = []
         self.points = []
@@ -50,8 +74,10 @@ class Simulation:
         self.pres = pres
 
         self.frame_id = 0
-        self.chrono_p_x = []
-        self.chrono_p_y = []
+        self.t = 0.0
+        # Steps computed since init (frames in adaptive or parallel mode), numbers the checkpoints
+        self.steps = 0
+        self.recorders: list[Recorder] = []
 
         self.selected: Optional[Point] = None
         self.selected_is_not_updatable = False
@@ -59,12 +85,196 @@ class Simulation:
         self.mouse_pos: complex = 0
         self.mouse_last_pos: complex = 0
 
+        self.state: Optional[ArrayState] = None
+        self.state_forces: list[Force] = []
+        self.state_post_forces: list[Force] = []
+        self.kinematic_points: list[UpdatablePoint] = []
+        # Drivers of the DrivenPoint (drivers.py), built by init
+        self.drivers: list[Driver] = []
+        # Points reset one by one by init, the state resets the others
+        self.reset_points: list[UpdatablePoint] = self.updatable_points
+        self.integrator: Integrator = INTEGRATORS[integrator]()
+
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.adaptive_dt = self.dt
+        self.rejected_steps = 0
+
+        self.batch = batch
+        self.batch_draw = batch_draw
+        self.renderer: Optional["BatchRenderer"] = None
+        # Shown forces whose contribution is kept at each step, with the indices of their points in the state
+        self.captured_forces: dict[Force, Optional[np.ndarray]] = {}
+        self.profiler = profiler
+        self.spatial: Optional[UniformGrid] = None
+
+        # Islands put to sleep (islands.py), the forces and points of the awake ones. None: everything is active.
+        self.sleeping = sleeping
+        self.islands: Optional[Islands] = None
+        self.island_steps = 0
+        self.active_forces: Optional[list[Force]] = None
+        self.active_points: Optional[list[UpdatablePoint]] = None
+
+        # Islands computed by worker processes (parallel.py), started by init
+        self.workers = workers
+        self.parallel: Optional["ParallelRunner"] = None
+        # Periodic checkpoints (checkpoint.py), at the end of a step (of a frame in adaptive mode)
+        self.checkpointer: Optional["Checkpointer"] = None
+        if state is not None or vectorized or adaptive or batch is not None or integrator != Euler.name:
+            self.vectorize(state)
+
+    def vectorize(self, state: Optional[ArrayState] = None):
+        # state: already built for self.points + self.updatable_points, in this order (see scenefile.py)
+        if self.state is not None:
+            return
+        self.state = ArrayState(self.points + self.updatable_points, self.batch) if state is None else state
+        self.kinematic_points = [p for p in self.updatable_points if not isinstance(p, (MassPoint, DrivenPoint))]
+        self.reset_points = [p for p in self.updatable_points
+                             if not isinstance(p, MassPoint) or p.past_pos_x is not None]
+        self.bind_forces(self.forces, self.post_update_force)
+        for f in self.captured_forces:
+            self.captured_forces[f] = self.state.indices(f.points)
+        if self.drivers:
+            self.bind_drivers()
+
+    def bind_forces(self, forces: list[Force], post_update_force: list[Force]):
+        self.state_forces = self.batch_forces(forces)
+        self.state_post_forces = self.batch_forces(post_update_force)
+        for f in chain(self.state_forces, self.state_post_forces):
+            f.bind(self.state)
+
+    @staticmethod
+    def batch_forces(forces: list[Force]) -> list[Force]:
+        # The forces with a batch_class grouped in one force per class, in place of the first of them
+        batched = []
+        batches: dict[type, list[Force]] = {}
+        for f in forces:
+            if f.batch_class is None or f.show:
+                batched.append(f)
+            elif f.batch_class in batches:
+                batches[f.batch_class].append(f)
+            else:
+                batches[f.batch_class] = [f]
+                batched.append(f.batch_class(batches[f.batch_class]))
+        return batched
+
+    def bind_drivers(self):
+        # One driver per class of driven points, with their current parameters
+        for d in self.drivers:
+            d.unbind()
+        groups: dict[type, list[DrivenPoint]] = {}
+        for p in self.updatable_points:
+            if isinstance(p, DrivenPoint):
+                groups.setdefault(p.driver_class, []).append(p)
+        self.drivers = [cls(points, self.state) for cls, points in groups.items()]
+
+    def drive(self, t: float):
+        for d in self.drivers:
+            d.move(self.state, t)
+
     def step(self):
-        for f in self.forces:
-            f.update()
+        prof = self.profiler
+        if prof is not None:
+            start = perf_counter()
+        if self.state is not None:
+            self.step_state()
+        else:
+            self.step_objects()
+        if prof is not None:
+            prof.add("step", "", perf_counter() - start)
+        self.steps += 1
+        self.record()
+        if self.islands is not None:
+            self.island_steps += 1
+            if self.island_steps == self.pres:
+                self.island_steps = 0
+                self.check_islands()
+        if self.checkpointer is not None:
+            self.checkpointer.step(self)
+
+    def record(self):
+        if not self.recorders:
+            return
+        prof = self.profiler
+        if prof is not None:
+            start = perf_counter()
+        for r in self.recorders:
+            r.record(self)
+        if prof is not None:
+            prof.add("record", "", perf_counter() - start)
+
+    def step_objects(self):
+        prof = self.profiler
+        forces = chain(self.forces, self.post_update_force) if self.active_forces is None else self.active_forces
+        if prof is None and not self.captured_forces:
+            for f in forces:
+                f.update()
+        else:
+            self.update_forces_captured(forces)
 
-        for f in self.post_update_force:
-            f.update()
+        if self.selected is not None:
+            self.selected.on_select_move(self.mouse_pos)
+            if isinstance(self.selected, MassPoint):
+                self.selected.v = 0
+                self.selected.ca = 0
+
+        points = self.updatable_points if self.active_points is None else self.active_points
+        if prof is None:
+            for p in points:
+                p.update(self.dt)
+            self.drive(self.t + self.dt)
+        else:
+            self.update_points_profiled(points, self.dt)
+            self.drive_profiled(self.t + self.dt)
+        self.t += self.dt
+
+    def update_forces_captured(self, forces: Iterable[Force]):
+        # Forces of the object engine, profiled or keeping the forces they apply
+        captured = self.captured_forces
+        prof = self.profiler
+        for f in forces:
+            if prof is not None:
+                start = perf_counter()
+            if captured and f in captured:
+                before = np.array([p.ca for p in f.points])
+                f.update()
+                f.last_forces = np.array([p.ca for p in f.points]) - before
+            else:
+                f.update()
+            if prof is not None:
+                prof.add("force", type(f).__name__, perf_counter() - start)
+
+    def update_points_profiled(self, points: list[UpdatablePoint], dt: float):
+        prof = self.profiler
+        for p in points:
+            start = perf_counter()
+            p.update(dt)
+            prof.add("point", type(p).__name__, perf_counter() - start)
+
+    def drive_profiled(self, t: float):
+        prof = self.profiler
+        for d in self.drivers:
+            start = perf_counter()
+            d.move(self.state, t)
+            prof.add("driver", type(d).__name__, perf_counter() - start)
+
+    def compute_forces(self):
+        state = self.state
+        state.ca.fill(0)
+        captured = self.captured_forces
+        prof = self.profiler
+        for f in chain(self.state_forces, self.state_post_forces):
+            if prof is not None:
+                start = perf_counter()
+            if captured and f in captured:
+                idx = captured[f]
+                before = state.view_ca[idx]
+                f.update_state(state)
+                f.last_forces = state.view_ca[idx] - before
+            else:
+                f.update_state(state)
+            if prof is not None:
+                prof.add("force", type(f).__name__, perf_counter() - start)
 
         if self.selected is not None:
             self.selected.on_select_move(self.mouse_pos)
@@ -72,24 +282,168 @@ class Simulation:
                 self.selected.v = 0
                 self.selected.ca = 0
 
-        for p in self.updatable_points:
-            p.update(self.dt)
+    def step_state(self, dt: Optional[float] = None):
+        dt = self.dt if dt is None else dt
+        prof = self.profiler
+        if prof is None:
+            self.integrator.step(self, dt)
+            self.drive(self.t + dt)
+            for p in self.kinematic_points:
+                p.update(dt)
+        else:
+            # Includes the time of the forces computed by the integrator
+            start = perf_counter()
+            self.integrator.step(self, dt)
+            prof.add("integrator", self.integrator.name, perf_counter() - start)
+            self.drive_profiled(self.t + dt)
+            self.update_points_profiled(self.kinematic_points, dt)
+        self.t += dt
+
+    def update_adaptive(self):
+        # Step doubling: a step of h is compared to two steps of h / 2, the difference estimates the local error.
+        state = self.state
+        frame_end = self.t + self.interval / 1000
+        min_dt = self.dt / ADAPTIVE_MAX_SHRINK
+        order = self.integrator.order
+
+        while frame_end - self.t > min_dt / 2:
+            h = min(self.adaptive_dt, frame_end - self.t)
+            t0 = self.t
+            saved = state.save()
+
+            self.step_state(h)
+            p_full, v_full = state.p.copy(), state.v.copy()
+
+            state.restore(saved)
+            self.integrator.reset()
+            self.t = t0
+            self.step_state(h / 2)
+            self.step_state(h / 2)
+
+            err = max(np.max(np.abs(state.p - p_full), initial=0), h * np.max(np.abs(state.v - v_full), initial=0))
+            factor = 0.9 * (self.tolerance / err) ** (1 / (order + 1)) if err > 0 else 5
+            factor = min(5.0, max(0.2, factor))
+
+            if err > self.tolerance and h > min_dt:
+                state.restore(saved)
+                self.integrator.reset()
+                self.t = t0
+                self.adaptive_dt = max(min_dt, h * factor)
+                self.rejected_steps += 1
+                continue
+
+            if h < self.adaptive_dt:
+                # Clamped to land on the frame boundary, do not let the shortened step shrink the next ones.
+                self.adaptive_dt = max(self.adaptive_dt, h * factor)
+            else:
+                self.adaptive_dt = h * factor
+            self.record()
+        self.t = frame_end
 
     def init(self):
-        for p in self.updatable_points:
+        for p in self.reset_points:
             p.reset()
+        if self.state is not None:
+            self.state.reset()
         self.frame_id = 0
-        self.chrono_p_x = []
-        self.chrono_p_y = []
+        self.t = 0.0
+        self.steps = 0
+        for r in self.recorders:
+            r.reset()
+        if self.renderer is not None:
+            self.renderer.reset()
+        self.integrator.reset()
+        self.adaptive_dt = self.dt
+        self.rejected_steps = 0
+        self.bind_drivers()
+        self.drive(self.t)
+        if self.workers:
+            # The workers put their own islands to sleep
+            if self.parallel is None:
+                from parallel import ParallelRunner
+
+                self.parallel = ParallelRunner(self, self.workers)
+            else:
+                self.parallel.init()
+        elif self.sleeping:
+            if self.state is not None and self.state.batch_shape:
+                raise ValueError("islands cannot sleep in a batched simulation")
+            if self.islands is None:
+                self.islands = Islands(self)
+            self.island_steps = 0
+            self.islands.awake.fill(True)
+            self.islands.calm.fill(0)
+            self.refresh_active()
 
     def update(self):
-        for _ in range(self.pres):
-            self.step()
+        prof = self.profiler
+        if prof is not None:
+            start = perf_counter()
+        if self.parallel is not None:
+            self.parallel.update()
+            self.steps += 1
+            self.record()
+        elif self.adaptive:
+            self.update_adaptive()
+            self.steps += 1
+            if self.islands is not None:
+                self.check_islands()
+            if self.checkpointer is not None:
+                self.checkpointer.step(self)
+        else:
+            for _ in range(self.pres):
+                self.step()
+        if prof is not None:
+            prof.add("update", "", perf_counter() - start)
+
+    def close(self):
+        # Stops the worker processes and waits for the pending checkpoint to be written (no new one is taken), the
+        # simulation can be started again by init
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
+
+    def check_islands(self):
+        # Once per frame
+        v = self.state.v if self.state is not None else \
+            np.array([p.v if isinstance(p, MassPoint) else 0 for p in chain(self.points, self.updatable_points)])
+        if self.islands.check(self, v):
+            self.refresh_active()
+
+    def refresh_active(self):
+        # Only the forces touching an awake island are computed, the points of the sleeping ones are stopped
+        islands = self.islands
+        forces = [f for f in self.forces if islands.active(f)]
+        post_update_force = [f for f in self.post_update_force if islands.active(f)]
+        sleeping = islands.sleeping_points()
+        state = self.state
+        if state is None:
+            self.active_forces = forces + post_update_force
+            awake = np.ones(len(islands.points), dtype=bool)
+            awake[sleeping] = False
+            self.active_points = [p for p, a in zip(self.updatable_points, awake[len(self.points):]) if a]
+            for p in self.updatable_points:
+                if isinstance(p, MassPoint):
+                    p.ca = 0
+            for i in sleeping:
+                islands.points[i].v = 0
+        else:
+            self.bind_forces(forces, post_update_force)
+            state.inv_m.fill(0)
+            state.inv_m[state.mass_idx] = 1 / state.m[state.mass_idx]
+            state.inv_m[sleeping] = 0
+            state.v[sleeping] = 0
+            self.integrator.reset()
 
     def __repr__(self) -> str:
         return f"Points: {self.updatable_points}"
 
-    def on_move(self, event: MouseEvent):
+    def on_move(self, event: "MouseEvent"):
+        from matplotlib.backend_bases import MouseButton
+
         if event.button is MouseButton.LEFT:
             if event.inaxes:
                 self.mouse_last_pos = self.mouse_pos
@@ -98,20 +452,38 @@ class Simulation:
             event.button = MouseButton.LEFT
             self.on_release(event)
 
-    def on_press(self, event: MouseEvent):
+    def on_press(self, event: "MouseEvent"):
+        from matplotlib import pyplot as plt
+        from matplotlib.backend_bases import MouseButton
+
         if event.button is MouseButton.LEFT and event.inaxes:
             c = complex(event.xdata, event.ydata)
-            min_non_updatable = min(self.points, key=lambda p: abs(c - p.p), default=None)
-            min_updatable = min(self.updatable_points, key=lambda p: abs(c - p.p), default=None)
-            point = min((min_updatable, min_non_updatable), key=lambda p: abs(c - p.p), default=None)
-            if point is not None and abs(c - point.p) < SELECT_RADIUS:
-                self.selected = point
+            i = self.point_index().nearest(c, SELECT_RADIUS)
+            if i is not None:
+                self.selected = (self.points + self.updatable_points)[i]
                 self.mouse_pos = c
                 self.mouse_last_pos = c
-                self.selected_is_not_updatable = point == min_non_updatable
+                self.selected_is_not_updatable = i < len(self.points)
                 self.select_event_id = plt.connect('motion_notify_event', self.on_move)
+                if self.islands is not None and self.islands.wake(self.islands.islands_of(self.selected)):
+                    self.refresh_active()
+
+    def point_index(self) -> UniformGrid:
+        # Grid over the positions of self.points + self.updatable_points (the state order), updated on each call
+        if self.state is not None:
+            p = self.state.view_p
+        else:
+            p = np.array([pt.p for pt in chain(self.points, self.updatable_points)], dtype=complex)
+        if self.spatial is None:
+            self.spatial = UniformGrid(SELECT_RADIUS, p)
+        else:
+            self.spatial.update(p)
+        return self.spatial
+
+    def on_release(self, event: "MouseEvent"):
+        from matplotlib import pyplot as plt
+        from matplotlib.backend_bases import MouseButton
 
-    def on_release(self, event: MouseEvent):
         if event.button is MouseButton.LEFT and self.selected is not None:
             if isinstance(self.selected, MassPoint):
                 c = complex(event.xdata, event.ydata) if event.inaxes else self.mouse_pos
@@ -121,6 +493,14 @@ class Simulation:
             plt.disconnect(self.select_event_id)
 
     def init_draw(self):
+        from matplotlib import pyplot as plt
+
+        if self.batch_draw:
+            from render import BatchRenderer
+
+            self.renderer = BatchRenderer(self)
+            self.renderer.init_draw(self.drawables)
+
         for f in self.forces:
             f.init_draw(self.drawables)
 
@@ -133,6 +513,10 @@ class Simulation:
         return self.drawables
 
     def draw(self):
+        prof = self.profiler
+        if prof is not None:
+            return self.draw_profiled()
+
         for f in self.forces:
             f.draw(self.frame_id)
 
@@ -142,5 +526,31 @@ class Simulation:
         if self.selected_is_not_updatable:
             self.selected.draw(self.frame_id)
 
+        if self.renderer is not None:
+            self.renderer.draw(self.frame_id)
+
+        self.frame_id += 1
+        return self.drawables
+
+    def draw_profiled(self):
+        prof = self.profiler
+        frame_start = perf_counter()
+        for f in self.forces:
+            start = perf_counter()
+            f.draw(self.frame_id)
+            prof.add("draw force", type(f).__name__, perf_counter() - start)
+
+        points = self.updatable_points + [self.selected] if self.selected_is_not_updatable else self.updatable_points
+        for p in points:
+            start = perf_counter()
+            p.draw(self.frame_id)
+            prof.add("draw point", type(p).__name__, perf_counter() - start)
+
+        if self.renderer is not None:
+            start = perf_counter()
+            self.renderer.draw(self.frame_id)
+            prof.add("draw batch", type(self.renderer).__name__, perf_counter() - start)
+
         self.frame_id += 1
+        prof.add("draw", "", perf_counter() - frame_start)
         return self.drawables
@@ -0,0 +1,123 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Uniform grid over point positions (complex array), for the queries that would otherwise compare every point
+# with every other: nearest point, points within a radius, close pairs.
+# The points are sorted by cell: the points of a cell are order[start[c]:start[c] + count[c]], the cells being
+# found by a binary search on their sorted keys. A query costs the cells it covers, whatever the number of points.
+from typing import Optional
+
+import numpy as np
+
+# 3 x 3 block of cells around a cell
+NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def cell_keys(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    return ix * (1 << 32) + iy
+
+
+class UniformGrid:
+    def __init__(self, cell: float, p: Optional[np.ndarray] = None) -> None:
+        self.cell = cell
+        self.p = np.zeros(0, dtype=complex)
+        self.ix = self.iy = self.keys = np.zeros(0, dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.intp)
+        self.cells = self.start = self.count = np.zeros(0, dtype=np.int64)
+        if p is not None:
+            self.build(p)
+
+    def __len__(self) -> int:
+        return len(self.p)
+
+    def coords(self, p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return np.floor(p.real / self.cell).astype(np.int64), np.floor(p.imag / self.cell).astype(np.int64)
+
+    def build(self, p: np.ndarray) -> None:
+        self.p = np.array(p, dtype=complex)
+        self.ix, self.iy = self.coords(self.p)
+        self.keys = cell_keys(self.ix, self.iy)
+        self.order = np.argsort(self.keys, kind="stable")
+        self.cells, self.start, self.count = np.unique(self.keys[self.order], return_index=True, return_counts=True)
+
+    def update(self, p: np.ndarray) -> None:
+        # Sorted again only when a point changed of cell (or the number of points changed)
+        if len(p) != len(self.p):
+            return self.build(p)
+        ix, iy = self.coords(p)
+        if np.array_equal(ix, self.ix) and np.array_equal(iy, self.iy):
+            np.copyto(self.p, p)
+        else:
+            self.build(p)
+
+    def find_cells(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Index in self.cells of each key, and whether the cell exists (holds points)
+        c = np.searchsorted(self.cells, keys)
+        found = c < len(self.cells)
+        found[found] = self.cells[c[found]] == keys[found]
+        return c, found
+
+    def members(self, c: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Points of the cells c, with for each one the position in c of its cell
+        count = self.count[c]
+        owner = np.repeat(np.arange(len(c)), count)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(count) - count, count)
+        return self.order[self.start[c][owner] + offset], owner
+
+    def query_radius(self, c: complex, r: float) -> np.ndarray:
+        # Indices of the points strictly closer than r to c
+        (x0, x1), (y0, y1) = self.coords(np.array([c - r * (1 + 1j), c + r * (1 + 1j)]))
+        ix, iy = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+        cells, found = self.find_cells(cell_keys(ix.ravel(), iy.ravel()))
+        idx, _ = self.members(cells[found])
+        return idx[np.abs(self.p[idx] - c) < r]
+
+    def nearest(self, c: complex, r: float) -> Optional[int]:
+        # Closest point strictly closer than r to c, None if there is none
+        idx = self.query_radius(c, r)
+        if not len(idx):
+            return None
+        return int(idx[np.argmin(np.abs(self.p[idx] - c))])
+
+    def nearest_all(self, c: np.ndarray, r: float) -> np.ndarray:
+        # nearest for every point of c at once, -1 where there is none. r must not exceed the size of a cell.
+        if r > self.cell:
+            raise ValueError(f"points closer than {r} need cells of at least this size (cell: {self.cell})")
+        ix, iy = self.coords(c)
+        queries = np.arange(len(c))
+        first = []
+        second = []
+        for dx, dy in NEIGHBOURS:
+            cells, found = self.find_cells(cell_keys(ix + dx, iy + dy))
+            j, owner = self.members(cells[found])
+            first.append(queries[found][owner])
+            second.append(j)
+        q = np.concatenate(first)
+        j = np.concatenate(second)
+        d = np.abs(self.p[j] - c[q])
+        close = d < r
+        q, j, d = q[close], j[close], d[close]
+        order = np.lexsort((d, q))
+        q, first_of_q = np.unique(q[order], return_index=True)
+        nearest = np.full(len(c), -1, dtype=np.intp)
+        nearest[q] = j[order][first_of_q]
+        return nearest
+
+    def pairs(self, r: float) -> tuple[np.ndarray, np.ndarray]:
+        # Every pair (i, j), i < j, of points strictly closer than r. r must not exceed the size of a cell.
+        if r > self.cell:
+            raise ValueError(f"pairs closer than {r} need cells of at least this size (cell: {self.cell})")
+        first = []
+        second = []
+        points = np.arange(len(self.p))
+        for dx, dy in NEIGHBOURS:
+            cells, found = self.find_cells(cell_keys(self.ix + dx, self.iy + dy))
+            j, owner = self.members(cells[found])
+            i = points[found][owner]
+            keep = i < j
+            first.append(i[keep])
+            second.append(j[keep])
+        i = np.concatenate(first)
+        j = np.concatenate(second)
+        close = np.abs(self.p[i] - self.p[j]) < r
+        return i[close], j[close]
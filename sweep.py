@@ -0,0 +1,169 @@
+# PhysicsSimulator Copyright (C) 2023 Antonin LOUBIERE
+# License GPL-3 <https://www.gnu.org/licenses/gpl-3.0.html>
+
+# Runs a scene factory over a parameter grid and/or many seeds on every core.
+#
+#   python sweep.py scenes:double_pendulum --param k=0,0.025,0.05 --seeds 100 --steps 5000 -o sweep.npz
+#
+# Every finished run is appended to a journal (<output>.jsonl) as soon as it comes back: rerunning the same
+# command resumes the sweep without redoing the runs already in the journal. Once every run is done, the journal
+# is gathered into a columnar npz file (one array per parameter or measure).
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+
+from headless import run
+from points import MassPoint
+from simulator import Simulation
+
+
+def grid(**axes: list) -> list[dict[str, Any]]:
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def run_seed(base_seed: int, run_id: int) -> int:
+    return int(np.random.SeedSequence([base_seed, run_id]).generate_state(1)[0])
+
+
+def summary(sim: Simulation) -> dict[str, float]:
+    masses = [p for p in sim.updatable_points if isinstance(p, MassPoint)]
+    return {
+        "t": sim.t,
+        "kinetic_energy": sum(0.5 * p.m * abs(p.v) ** 2 for p in masses),
+        "mean_x": float(np.mean([p.p.real for p in masses])) if masses else 0.0,
+        "mean_y": float(np.mean([p.p.imag for p in masses])) if masses else 0.0,
+    }
+
+
+def run_one(
+        factory: Callable[..., Simulation],
+        run_id: int,
+        params: dict[str, Any],
+        seed: int,
+        steps: int,
+        measure: Callable[[Simulation], dict[str, Any]],
+) -> dict[str, Any]:
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    sim = factory(**params)
+    sim.init()
+    run(sim, steps)
+    return {"run": run_id, "seed": seed, **params, **measure(sim), "elapsed": time.perf_counter() - start}
+
+
+def read_journal(path: str) -> dict[int, dict[str, Any]]:
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line cut by a crash
+                    continue
+                done[result["run"]] = result
+    return done
+
+
+def sweep(
+        factory: Callable[..., Simulation],
+        output: str,
+        steps: int,
+        params: Optional[list[dict[str, Any]]] = None,
+        seeds: int = 1,
+        base_seed: int = 0,
+        measure: Callable[[Simulation], dict[str, Any]] = summary,
+        workers: Optional[int] = None,
+) -> Iterator[dict[str, Any]]:
+    # factory and measure are sent to the workers: they must be module level functions.
+    runs = [p for p in (params or [{}]) for _ in range(seeds)]
+    journal = output + ".jsonl"
+    done = read_journal(journal)
+
+    workers = workers or os.cpu_count() or 1
+    todo = iter([i for i in range(len(runs)) if i not in done])
+    with ProcessPoolExecutor(workers) as executor, open(journal, "a+") as f:
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+
+        # A few runs per worker are queued at a time: a worker takes the next one as soon as it is free.
+        pending = set()
+        while True:
+            for i in itertools.islice(todo, 2 * workers - len(pending)):
+                pending.add(executor.submit(run_one, factory, i, runs[i], run_seed(base_seed, i), steps, measure))
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+                done[result["run"]] = result
+                yield result
+
+    save(output, [done[i] for i in sorted(done)])
+
+
+def save(path: str, results: list[dict[str, Any]]) -> None:
+    columns = {}
+    for result in results:
+        for name in result:
+            columns.setdefault(name, [])
+    for result in results:
+        for name, column in columns.items():
+            column.append(result.get(name, np.nan))
+    np.savez(path, **{name: np.array(column) for name, column in columns.items()})
+
+
+def load_function(name: str) -> Callable:
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def parse_value(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a scene factory over a parameter grid on every core.")
+    parser.add_argument("factory", help="scene factory, as module:function (e.g. scenes:random_network)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="values of a parameter of the factory, the runs cover every combination")
+    parser.add_argument("--seeds", type=int, default=1, help="number of seeds per combination")
+    parser.add_argument("--seed", type=int, default=0, help="base seed of the sweep")
+    parser.add_argument("--steps", type=int, required=True, help="number of steps of each run")
+    parser.add_argument("--measure", help="function computing the results of a run, as module:function")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("-o", "--output", default="sweep.npz")
+    args = parser.parse_args(argv)
+
+    axes = {}
+    for param in args.param:
+        name, _, values = param.partition("=")
+        axes[name] = [parse_value(v) for v in values.split(",")]
+
+    measure = summary if args.measure is None else load_function(args.measure)
+    for result in sweep(load_function(args.factory), args.output, args.steps, grid(**axes), args.seeds, args.seed,
+                        measure, args.workers):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()